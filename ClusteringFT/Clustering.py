@@ -8,6 +8,7 @@ from sklearn.preprocessing import LabelEncoder
 from scipy.stats import chi2_contingency
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from collections import defaultdict
+from decisionTreeLogic import duration_seconds
 
 # Function to sort and arrange the dictionary
 def sort_and_arrange(input_dict):
@@ -81,9 +82,10 @@ def Clustering():
     df = pd.read_csv(DATA_FILE)
 
     df['throttle'] = df['throttle'].apply(lambda x: str(x).split('.')[0] if pd.notna(x) else None)
+    # before the fillna below, so a missing duration is NaN instead of the string 'None'
+    df['duration'] = df['duration'].apply(duration_seconds)
     df.fillna(value='None', inplace=True)
     df['Wind'] = df['Wind'].apply(lambda x: 1 if x is not None else 0)
-    df['duration'] = pd.to_timedelta(df['duration']).dt.total_seconds()
     df = df.drop(columns='Unnamed: 0')
     df['throttle'] = df['throttle'].fillna('None')
     df = df.rename(columns={'MSN State': 'states'})
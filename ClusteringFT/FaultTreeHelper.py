@@ -13,26 +13,45 @@ import pandas as pd
 from schemdraw.parsing import logicparse
 import schemdraw
 import re
+import itertools
 import logicmin
 import cairosvg
 
+#above this many inputs, tables with don't-cares are minimized heuristically (expand_cover)
+EXACT_MINIMIZATION_VARS = 8
 GEOFENCE_ACTION = {1: "Warning", 2: "Hold mode", 3: "Return mode", 4: "Terminate", 5: "Land mode"}
 
 
 def minLogicFunc(truthtable):
+    '''
+    Minimal sum of products of the result column, in logicmin syntax ("r <= a.b' + c").
+    Input combinations missing from truthtable (infeasible rows) are don't-cares.
+    '''
 
     # Identify the input columns and the output column
     input_columns = [col for col in truthtable.columns if col != 'result']
     output_column = 'result'
 
+    rows = truthtable[input_columns].to_numpy(dtype=np.int8)
+    results = truthtable[output_column].to_numpy()
+    if len(input_columns) > EXACT_MINIMIZATION_VARS and len(rows) < 2 ** len(input_columns):
+        # too many don't-cares for Quine-McCluskey
+        cubes = expand_cover(rows[results == 1], rows[results != 1])
+        return 'r <= ' + cover_expression(cubes, input_columns)
+
     # Initialize the truth table with the appropriate number of inputs and 1 output
     t = logicmin.TT(len(input_columns), 1)
 
     # Add rows to the truth table (input, output)
-    for index, row in truthtable.iterrows():
-        inputs = ''.join(str(row[col]) for col in input_columns)
-        output = str(row[output_column])
-        t.add(inputs, output)
+    cared = set()
+    for inputs, output in zip(rows, results):
+        inputs = ''.join(str(value) for value in inputs)
+        cared.add(inputs)
+        t.add(inputs, str(output))
+    for inputs in itertools.product('01', repeat=len(input_columns)):
+        inputs = ''.join(inputs)
+        if inputs not in cared:
+            t.add(inputs, '-')
     # Initialize the truth table with 3 inputs and 1 output
     # t = logicmin.TT(3, 1)
 
@@ -54,6 +73,59 @@ def minLogicFunc(truthtable):
     return sols.printN(xnames=input_columns, ynames=output_column, info=False)
 
 
+def expand_cover(onset, offset):
+    '''
+    Cover of the onset rows by cubes (strings of '0', '1', '-') that contain no offset row.
+    Each uncovered onset row is expanded by dropping literals (negated ones first, so the
+    cubes read as the features that are set) while the cube stays clear of the offset;
+    redundant cubes are then dropped greedily. Cost grows with onset x offset rows only.
+    '''
+    cubes = []
+    covered = np.zeros(len(onset), dtype=bool)
+    for i, row in enumerate(onset):
+        if covered[i]:
+            continue
+        fixed = np.ones(len(row), dtype=bool)
+        differs = offset != row
+        mismatches = differs.sum(axis=1)
+        for bit in sorted(range(len(row)), key=lambda bit: (row[bit], bit)):
+            # the literal can go unless some offset row differs from the cube in this literal only
+            if not np.any((mismatches == 1) & differs[:, bit]):
+                fixed[bit] = False
+                mismatches -= differs[:, bit]
+        contained = np.all(onset[:, fixed] == row[fixed], axis=1)
+        covered |= contained
+        cubes.append((''.join(str(value) if keep else '-' for value, keep in zip(row, fixed)), contained))
+
+    # irredundant cover: take the cube covering most of what is still uncovered
+    cover = []
+    uncovered = np.ones(len(onset), dtype=bool)
+    while uncovered.any():
+        cube, contained = max(cubes, key=lambda item: np.count_nonzero(item[1] & uncovered))
+        cover.append(cube)
+        uncovered &= ~contained
+    return cover
+
+
+def cover_contains(cubes, rows):
+    '''For each row, whether any of the cubes contains it.'''
+    contained = np.zeros(len(rows), dtype=bool)
+    for cube in cubes:
+        fixed = np.array([value != '-' for value in cube], dtype=bool)
+        values = np.array([int(value) for value in cube if value != '-'], dtype=rows.dtype)
+        contained |= np.all(rows[:, fixed] == values, axis=1)
+    return contained
+
+
+def cover_expression(cubes, names):
+    '''Sum of products of cubes in logicmin syntax: "a.b' + c", "0" for no cube, "1" for a tautology.'''
+    terms = []
+    for cube in cubes:
+        literals = [name if value == '1' else name + "'" for name, value in zip(names, cube) if value != '-']
+        terms.append('.'.join(literals) if literals else '1')
+    return ' + '.join(terms) if terms else '0'
+
+
 
 
 def drawFaultTree(logic_expr, Centroid):
@@ -3,30 +3,162 @@ import paho.mqtt.client as mqtt
 import time
 import os
 import signal
+import tarfile
+import tempfile
+import threading
+from collections import defaultdict
+
+#the Docker Engine API client (pip install docker) is optional, without it every call goes through the docker CLI
+try:
+    import docker
+except ImportError:
+    docker = None
+
+#PX4 SITL client commands (px4-<module>) live next to the px4 binary
+PX4_BIN_DIR = "/home/user/Firmware/build/px4_sitl_default/bin"
+#parameters captured before the first mission and restored by every warm reset
+PARAM_SNAPSHOT = "/tmp/fuzz_param_snapshot.bson"
+#seconds before a warm reset is given up and the containers are restarted
+WARM_RESET_TIMEOUT = 30
+#PX4 SITL log directory inside the PX4 container
+PX4_LOG_DIR = "/home/user/Firmware/build/px4_sitl_default/logs/"
+#HTTP timeout of Engine API calls (warm resets are bounded by WARM_RESET_TIMEOUT in the container)
+DOCKER_API_TIMEOUT = 60
+#container role -> Docker_Interface attribute holding its name/id
+CONTAINER_ATTRIBUTES = {"state_machine": "state_machine_container", "px4": "px4_container", "airlease": "airlease"}
+LATEST_ULG_COMMAND = (
+    f"cd {PX4_LOG_DIR} && "
+    f"latest_dir=$(ls -td -- */ | head -n 1) && "
+    f"cd $latest_dir && "
+    f"latest_file=$(ls -t *.ulg | head -n 1) && "
+    f"echo $latest_dir$latest_file"
+)
+
+def warm_reset_command(snapshot=PARAM_SNAPSHOT):
+    '''
+    Shell command that resets the vehicle inside the running PX4 SITL container:
+    force-disarm, put the model back at its spawn pose, restore the parameter snapshot
+    (fuzz tests change e.g. GF_ACTION) and restart the estimator at the new pose.
+    '''
+    return (f"cd {PX4_BIN_DIR} && ./px4-commander disarm -f && gz world -r && "
+            f"./px4-param import {snapshot} && ./px4-ekf2 stop && ./px4-ekf2 start")
+
+def snapshot_command(snapshot=PARAM_SNAPSHOT):
+    return f"cd {PX4_BIN_DIR} && ./px4-param export {snapshot}"
+
+def summarize_latencies(reset_latencies):
+    '''{path: [seconds]} -> {path: {"count", "mean", "max"}}'''
+    return {path: {"count": len(latencies), "mean": sum(latencies) / len(latencies), "max": max(latencies)}
+            for path, latencies in reset_latencies.items() if latencies}
+
+class Container_Cache:
+    '''
+    Container handles of one vehicle stack, resolved once over a persistent Engine API connection.
+
+    Roles ("state_machine", "px4", "airlease") map to an explicit container name or to the
+    image the container runs. A handle stays cached until an API call reports the container
+    gone (it was recreated), then the role is resolved again.
+    '''
+
+    def __init__(self, client, lookups, on_resolve=None):
+        self.client = client
+        # role -> (container name or None, image)
+        self.lookups = lookups
+        # called with (role, container) whenever a role is (re)resolved
+        self.on_resolve = on_resolve
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def get(self, role):
+        with self._lock:
+            handle = self._handles.get(role)
+            if handle is None:
+                handle = self._resolve(role)
+                self._handles[role] = handle
+                if self.on_resolve is not None:
+                    self.on_resolve(role, handle)
+            return handle
+
+    def invalidate(self, role):
+        with self._lock:
+            self._handles.pop(role, None)
+
+    def _resolve(self, role):
+        name, image = self.lookups[role]
+        if name:
+            return self.client.containers.get(name)
+        # a recreated container may still be stopped (e.g. PX4 between stop and start), so include it but prefer running ones
+        containers = self.client.containers.list(all=True, filters={"ancestor": image})
+        if not containers:
+            raise docker.errors.NotFound(f"no container found for image {image}")
+        containers.sort(key=lambda container: container.status != "running")
+        return containers[0]
+
+    def call(self, role, action):
+        '''Run action(container), resolving the container again once if it was recreated.'''
+        try:
+            return action(self.get(role))
+        except docker.errors.NotFound:
+            print(f'[docker_interface] {role} container is gone, resolving it again')
+            self.invalidate(role)
+            return action(self.get(role))
 
 class Docker_Interface:
-    def __init__(self, mqtt_client=None,uav_id=None):
+    def __init__(self, mqtt_client=None,uav_id=None,stack=None,warm_reset=False):
         # bash command to start the state machine
         self.uav_id = uav_id 
-        self.state_machine_start = f"/bin/bash -c 'cd /catkin_ws/src/dr_onboard_autonomy/src/dr_onboard_autonomy && python state_machine.py _uav_name:={self.uav_id} _mqtt_host:=mqtt _local_mqtt_host:=mqtt_local'"
+        # a Vehicle_Stack (see campaign.py) pins the brokers and containers of one of several vehicles
+        mqtt_host = stack.mqtt_host if stack else "mqtt"
+        local_mqtt_host = stack.local_mqtt_host if stack else "mqtt_local"
+        self.abort_topic = stack.abort_topic if stack else "all-drones/abort"
+        self.state_machine_start = f"/bin/bash -c 'cd /catkin_ws/src/dr_onboard_autonomy/src/dr_onboard_autonomy && python state_machine.py _uav_name:={self.uav_id} _mqtt_host:={mqtt_host} _local_mqtt_host:={local_mqtt_host}'"
         self.dev_image_id = "dr-onboardautonomy-vs-code"
         self.px4_image_id = "dr-onboardautonomy-px4"
         self.airlease_id = "microservice-air-lease-air-lease"
-        self.airlease = self.get_container_name_by_image_id(self.airlease_id)
         # initialize process to None
         self.process = None
-        # get container name to use
-        self.state_machine_container = self.get_container_name_by_image_id(self.dev_image_id)
-        self.px4_container = self.get_container_name_by_image_id(self.px4_image_id)
+        # one Engine API connection for the lifetime of the interface, containers resolved once and cached
+        self.client = None
+        if docker is not None:
+            try:
+                self.client = docker.from_env(timeout=DOCKER_API_TIMEOUT)
+            except docker.errors.DockerException as e:
+                print(f"[docker_interface] Docker Engine API unavailable, using the docker CLI: {e}")
+        if self.client is not None:
+            self.containers = Container_Cache(self.client, {
+                "state_machine": (stack and stack.state_machine_container, self.dev_image_id),
+                "px4": (stack and stack.px4_container, self.px4_image_id),
+                "airlease": (stack and stack.airlease_container, self.airlease_id)
+            }, self._container_resolved)
+            # names until the containers are resolved; a missing container is only an error once it is used
+            self.airlease = stack and stack.airlease_container
+            self.state_machine_container = stack and stack.state_machine_container
+            self.px4_container = stack and stack.px4_container
+            for role in CONTAINER_ATTRIBUTES:
+                try:
+                    self.containers.get(role)
+                except docker.errors.DockerException as e:
+                    print(f"[docker_interface] No container found for {role} yet: {e}")
+        else:
+            # get container name to use
+            self.airlease = (stack and stack.airlease_container) or self.get_container_name_by_image_id(self.airlease_id)
+            self.state_machine_container = (stack and stack.state_machine_container) or self.get_container_name_by_image_id(self.dev_image_id)
+            self.px4_container = (stack and stack.px4_container) or self.get_container_name_by_image_id(self.px4_image_id)
         # MQTT client instance
         self.mqtt_client = mqtt_client
+        # reset the vehicle inside the running containers on abort, restarting them only if that fails
+        self.warm_reset = warm_reset or bool(stack and stack.warm_reset)
+        # reset path ("warm", "warm_failed", "cold") -> seconds per reset
+        self.reset_latencies = defaultdict(list)
+        if self.warm_reset:
+            self.take_param_snapshot()
 
     def get_container_name_by_image_id(self, image_id):
         """Retrieve the container ID for a given image ID."""
         try:
             # This command lists all containers, filters those matching the image ID, and gets the name
-            command = f"docker ps --filter ancestor={image_id} --format '{{{{.ID}}}}'"
-            result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, text=True)
+            command = ["docker", "ps", "--filter", f"ancestor={image_id}", "--format", "{{.ID}}"]
+            result = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
             container_name = result.stdout.strip()
             if container_name:
                 return container_name
@@ -37,76 +169,163 @@ class Docker_Interface:
             print(f"[docker_interface] Failed to execute docker command: {e}")
             return None
 
+    def _container_resolved(self, role, container):
+        # keep the container id attributes (used in messages and by the CLI fallback) current after a recreate
+        setattr(self, CONTAINER_ATTRIBUTES[role], container.id)
+
+    def _container_command(self, role, action):
+        """Run start/stop/restart on a container; returns True on success."""
+        if self.client is None:
+            container = getattr(self, CONTAINER_ATTRIBUTES[role])
+            return subprocess.run(["docker", action, container]).returncode == 0
+        try:
+            self.containers.call(role, lambda container: getattr(container, action)())
+            return True
+        except docker.errors.APIError as e:
+            print(f"[docker_interface] {action} of the {role} container failed: {e}")
+            return False
+
+    def _exec(self, role, command, timeout=None):
+        """
+        Run a command (argument list) in a container and return (exit code, output).
+        With a timeout (seconds) the CLI call raises subprocess.TimeoutExpired; an API exec has no
+        timeout of its own, so the command runs under timeout(1) in the container (exit code 124).
+        """
+        if self.client is None:
+            container = getattr(self, CONTAINER_ATTRIBUTES[role])
+            result = subprocess.run(["docker", "exec", container] + command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=timeout)
+            return result.returncode, result.stdout
+        if timeout is not None:
+            command = ["timeout", "-k", "5", str(timeout)] + command
+        result = self.containers.call(role, lambda container: container.exec_run(command))
+        return result.exit_code, result.output.decode('utf-8', 'replace')
+
     def start_px4(self):
         """Start the PX4 container."""
-        command = f"docker start {self.px4_container}"
-        result = os.system(command)
-        if result == 0:
+        if self._container_command("px4", "start"):
             print(f"[docker_interface] Started PX4 container {self.px4_container}")
         else:
             print(f"[docker_interface] Failed to start PX4 container {self.px4_container}")
 
     def restart_airlease(self):
         """Start the PX4 container."""
-        command = f"docker restart {self.airlease}"
-        result = os.system(command)
-        if result == 0:
+        if self._container_command("airlease", "restart"):
             print(f"[docker_interface] Started airlease container {self.airlease}")
         else:
             print(f"[docker_interface] Failed to start airlease container {self.airlease}")
 
     def stop_px4(self):
         """Stop the PX4 container."""
-        command = f"docker stop {self.px4_container}"
-        result = os.system(command)
-        if result == 0:
+        if self._container_command("px4", "stop"):
             print(f"[docker_interface] Stopped PX4 container {self.px4_container}")
         else:
             print(f"[docker_interface] Failed to stop PX4 container {self.px4_container}")
 
 
     def spawn_state_machine(self):
+        if self.client is not None:
+            # detached exec through the API: nothing is forked on this side
+            self.containers.call("state_machine", lambda container: container.exec_run(["/bin/bash", "-c", self.state_machine_start], detach=True))
+            self.process = None
+            return None
         command = ["docker", "exec", self.state_machine_container, "/bin/bash", "-c", self.state_machine_start]
         self.process = subprocess.Popen(command, preexec_fn=os.setpgrp,stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         return self.process
 
     def abort_mission(self):
-        self.mqtt_client.publish("all-drones/abort", "Shutdown",qos=1)
+        self.mqtt_client.publish(self.abort_topic, "Shutdown",qos=1)
         unique_pattern = f"state_machine.py _uav_name:={self.uav_id}"
-        kill_command = ["docker", "exec", self.state_machine_container, "pkill", "-f", unique_pattern]
-        try:
-            subprocess.run(kill_command, check=True)
+        returncode, output = self._exec("state_machine", ["pkill", "-f", unique_pattern])
+        if returncode == 0:
             print('[docker_interface] State machine process killed successfully.')
-        except subprocess.CalledProcessError as e:
-            if e.returncode == 1:
-                print('[docker_interface] No process found to kill.')
-            else:
-                print(f'[docker_interface] Error while killing the process: {e}')
+        elif returncode == 1:
+            print('[docker_interface] No process found to kill.')
+        else:
+            print(f'[docker_interface] Error while killing the process: {output.strip()}')
+        if self.warm_reset and self.warm_reset_px4():
+            return
+        self.cold_reset()
+
+    def cold_reset(self):
+        """Restart PX4 and the air-lease service (the full reset, also the warm reset fallback)."""
+        start = time.monotonic()
         self.stop_px4()
         self.restart_airlease()
         self.start_px4()
+        self._record_reset("cold", start)
+
+    def take_param_snapshot(self):
+        """Export the current PX4 parameters for warm resets; warm resets are disabled if this fails."""
+        try:
+            returncode, output = self._exec("px4", ["/bin/bash", "-c", snapshot_command()])
+        except Exception as e:
+            # PX4 not running yet: docker.errors.DockerException (NotFound, APIError) from the API,
+            # or no container / docker CLI to run it with
+            returncode, output = None, str(e)
+        if returncode != 0:
+            print(f'[docker_interface] parameter snapshot failed, using cold resets: {output.strip()}')
+            self.warm_reset = False
+
+    def warm_reset_px4(self):
+        """
+        Reset the vehicle in place (see warm_reset_command) while the air-lease service restarts in parallel.
+        Returns False if any step failed, so the caller can fall back to a cold reset.
+        """
+        start = time.monotonic()
+        airlease_result = []
+        airlease = threading.Thread(target=lambda: airlease_result.append(self._container_command("airlease", "restart")))
+        airlease.start()
+        try:
+            returncode, output = self._exec("px4", ["/bin/bash", "-c", warm_reset_command()], WARM_RESET_TIMEOUT)
+        except Exception as e:
+            # CLI timeout, or the API connection timing out / failing
+            returncode, output = None, str(e)
+        airlease.join()
+        if returncode != 0 or not airlease_result[0]:
+            print(f'[docker_interface] warm reset failed, falling back to a container restart: {output.strip()}')
+            self._record_reset("warm_failed", start)
+            return False
+        self._record_reset("warm", start)
+        return True
+
+    def _record_reset(self, path, start):
+        latency = time.monotonic() - start
+        self.reset_latencies[path].append(latency)
+        print(f'[docker_interface] {path} reset took {latency:.2f}s')
+
+    def reset_summary(self):
+        return summarize_latencies(self.reset_latencies)
     
     def get_latest_ulg_file(self):
         """Get the full path of the most recently written .ulg file in the latest log directory."""
-        try:
-            # Command to find the full path of the most recent .ulg file
-            command = (
-                f"docker exec {self.px4_container} /bin/bash -c "
-                f"'cd /home/user/Firmware/build/px4_sitl_default/logs/ && "
-                f"latest_dir=$(ls -td -- */ | head -n 1) && "
-                f"cd $latest_dir && "
-                f"latest_file=$(ls -t *.ulg | head -n 1) && "
-                f"echo $latest_dir$latest_file'"
-            )
-            # Run the command and capture the output
-            result = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            latest_ulg_file_path = result.stdout.strip()
-            return latest_ulg_file_path
-        except subprocess.CalledProcessError as e:
-            print(f"[docker_interface] Failed to get the latest .ulg file path: {e.stderr}")
+        returncode, output = self._exec("px4", ["/bin/bash", "-c", LATEST_ULG_COMMAND])
+        if returncode != 0:
+            print(f"[docker_interface] Failed to get the latest .ulg file path: {output}")
             return None
+        return output.strip()
+
+    def copy_log(self, ulg_file_path, destination_dir):
+        """Copy a log out of the PX4 container into destination_dir and return the local path."""
+        source_path = PX4_LOG_DIR + ulg_file_path
+        if self.client is None:
+            subprocess.run(["docker", "cp", f"{self.px4_container}:{source_path}", destination_dir])
+            return os.path.join(destination_dir, os.path.basename(ulg_file_path))
+        # the API returns the file as a tar stream; spool it to disk instead of holding the log in memory
+        stream, _ = self.containers.call("px4", lambda container: container.get_archive(source_path))
+        with tempfile.TemporaryFile(dir=destination_dir) as archive:
+            for chunk in stream:
+                archive.write(chunk)
+            archive.seek(0)
+            with tarfile.open(fileobj=archive) as tar:
+                member = tar.next()
+                member.name = os.path.basename(member.name)
+                tar.extract(member, destination_dir)
+        return os.path.join(destination_dir, os.path.basename(ulg_file_path))
 
     def run_onboard(self):
         self.process = self.spawn_state_machine()
+        if self.process is None:
+            print('[docker_interface] state machine started through the Docker API')
+            return
         process_pid = os.getpgid(self.process.pid)
         print('[docker_interface] state machine process started with PID:', process_pid)
\ No newline at end of file
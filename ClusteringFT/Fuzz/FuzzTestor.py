@@ -11,7 +11,6 @@ import signal
 import sys 
 import logging 
 import queue 
-import pickle
 import os 
 from geometry_msgs.msg import PoseStamped
 from dataclasses import dataclass, field, asdict
@@ -20,6 +19,8 @@ import numpy as np
 from typing import Tuple
 import sys 
 import glob
+import shutil
+import tempfile
 
 # from .DockerInterface import Docker_Interface
 # from .entities import Fuzz_Test
@@ -32,6 +33,14 @@ from DockerInterface import Docker_Interface
 from entities import Fuzz_Test
 from ROSInterface import ROS_Interface
 from  log_analyzer import get_max_deviation
+from log_analyzer.blueprint_cache import get_blueprint
+from log_analyzer.stream_monitor import Deviation_Monitor, Log_Follower
+from mission_watchdog import Mission_Watchdog
+from log_watcher import Log_Watcher
+from result_store import Result_Store
+from test_journal import Test_Journal
+from fuzz_common import (MQTT_MISSION, CONTENDER_LOG_DIR, LOG_CLOSE_TIMEOUT, RECOVERY_WINDOW, select_fuzz_test, execute_fuzz_test,
+    mark_executed, recovered, injection_offsets, mission_records)
 
 
 
@@ -64,16 +73,40 @@ SEND_CMD = 'mavros/cmd/command'
 MAV_STATE = '/mavros/state'
 SERVICES = [SEND_CMD,GET_PARAM_TOPIC,SET_PARAM_TOPIC]
 
-#MQTT MISSION SENDER PUB TOPIC and SUB TOPIC for onboard updates 
-MQTT_MISSION="drone/{}/mission-spec"
+#MQTT SUB TOPIC for onboard updates (the mission topic is MQTT_MISSION, see fuzz_common)
 MQTT_SUB = "update_drone"
+MQTT_READY = "fuzz_mission/ready"
 
 #BLUEPRINT MISSION
 MISSION_FILE = 'missions/FUZZ_MISSION.json'
+
+#seconds to wait for PX4 to open the log of a starting mission, to follow it live (early_abort with a shared log directory)
+LOG_OPEN_TIMEOUT = 30
 class Fuzz_Testor():
-    def __init__(self,uav_id="Polkadot") -> None:
+    def __init__(self,uav_id="Polkadot",early_abort=False,stack=None,watchdog=None,warm_reset=False,log_dir=None,injections_per_flight=1,recovery_window=RECOVERY_WINDOW) -> None:
         signal.signal(signal.SIGINT, self.signal_handler)
-        self.uav_id = uav_id
+        #one vehicle of a multi-vehicle campaign (see campaign.py), None for the default single stack
+        self.stack = stack
+        self.uav_id = stack.uav_id if stack else uav_id
+        self.update_topic = stack.update_topic if stack else MQTT_SUB
+        self.ready_topic = stack.ready_topic if stack else MQTT_READY
+        #mission deadlines, keyed by uav_id; several Fuzz_Testors in one process can share a watchdog
+        self.owns_watchdog = watchdog is None
+        self.watchdog = watchdog if watchdog is not None else Mission_Watchdog()
+        #end a mission before the time threshold once the live deviation monitor flags it as failed
+        #(deviation, altitude, and freefall when the live log can be followed, see _start_monitor)
+        self.early_abort = early_abort
+        #reset PX4 in place on abort instead of restarting its container (falls back to a restart)
+        self.warm_reset = warm_reset
+        #local mount of the PX4 log directory: logs are handed over by a watcher and analyzed in place, never copied
+        log_dir = log_dir or (stack and stack.log_dir)
+        self.log_watcher = Log_Watcher(log_dir) if log_dir else None
+        self.log_mark = 0
+        #state fuzzing only: inject up to this many tests per flight, each once the flight recovered from the previous one (see _recovered)
+        self.injections_per_flight = injections_per_flight
+        self.recovery_window = recovery_window
+        #one row per mission, replaces Fuzz_Test_Logs.txt
+        self.result_store = Result_Store()
         #prepare threading events and bind to class 
         self.init_shared_variables()
         #prepare MQTT, and Docker Handler
@@ -86,13 +119,14 @@ class Fuzz_Testor():
 
         #init value for mission completion time 
         self.threshold = 75
-        #start time checking thread 
-        self.time_thread = threading.Thread(target=self.check_time_threshold)
-        self.time_thread.start()
 
         self.mission_thread = threading.Thread(target=self.send_mission_thread)
         self.mission_thread.start()
 
+        #analyzes finished missions while the next one flies
+        self.analysis_thread = threading.Thread(target=self.analysis_worker, daemon=True)
+        self.analysis_thread.start()
+
         self.output = ""
 
         # self.test_processing_thread = threading.Thread(target=self.process_tests)
@@ -108,21 +142,29 @@ class Fuzz_Testor():
         '''
         self.fuzz_type = None 
         self.executed_tests = set()
+        #state fuzzing: mode/throttle tests already injected in each state, and every mode/throttle test
+        self.tested_modes_by_state = defaultdict(set)
+        self.mode_throttle_combos = set()
+        self.recent_test = None
+        #executed tests, one line each, replayed by load_executed_tests to resume after a crash
+        self.test_journal = Test_Journal()
+        #every test read from the journal so far
+        self.journaled_tests = set()
 
         
 
     
-    def save_executed_tests(self):
-        with open('executed_tests.pkl', 'wb') as f:
-            pickle.dump(self.executed_tests, f)
+    def save_executed_tests(self, test):
+        self.test_journal.append(test)
                 
     def load_executed_tests(self):
-        # Define file path
-        file_path = 'executed_tests.pkl'
-        
-        # Load executed tests from the file if it exists
+        # Replay what was journaled since the last load;
+        # only tests of the current fuzz test (or campaign shard) count as executed
+        self.journaled_tests |= self.test_journal.replay()
         # for geofence tests it will be a set not partitioned by states
-        self.executed_tests = self._load_executed_tests()
+        self.executed_tests = self.journaled_tests & self.fuzz_test_combinations
+        if self.executed_tests:
+            print(f'[fuzz_testor] found {len(self.executed_tests)} executed tests, resuming')
         
         # Process the loaded tests for standard fuzzes
         # for standard tests (with states) we need to create a dictionary
@@ -130,17 +172,6 @@ class Fuzz_Testor():
             self.tested_modes_by_state = defaultdict(set)
             self._process_executed_tests()
 
-    def _load_executed_tests(self):
-        if os.path.exists('executed_tests.pkl'):
-            try:
-                with open('executed_tests.pkl', 'rb') as f:
-                    print('[fuzz_testor] found executed tests, loading...')
-                    return pickle.load(f)
-            except EOFError:
-                return set()
-        else:
-            return set()
-
     def _process_executed_tests(self):
         includes_modes = '_mode' in self.fuzz_type
         includes_throttles = '_throttle' in self.fuzz_type
@@ -178,15 +209,31 @@ class Fuzz_Testor():
         self.tests_queue = queue.Queue()
         self.test_ready = threading.Event()
 
+        #finished missions waiting for log analysis, see submit_analysis
+        self.analysis_queue = queue.Queue()
+
         self.test_complete = threading.Event()
 
+        #in-flight deviation monitor (only used with early_abort) and the live log follower feeding it
+        self.monitor = None
+        self.log_follower = None
+        self.mission_failed = threading.Event()
+
+        #injections of the current flight as (test, state, time), and when the flight (and its log) started
+        self.flight_injections = []
+        self.flight_start = None
 
 
     def __init_mqtt(self) -> None:
-        self.mqtt_client = mqtt.Client("Fuzzing_System")
+        #client ids must be unique per broker, so campaign stacks append their uav name
+        client_id = f"Fuzzing_System_{self.uav_id}" if self.stack else "Fuzzing_System"
+        self.mqtt_client = mqtt.Client(client_id)
         self.mqtt_client.on_connect = self.mqtt_on_connect
 
-        self.mqtt_client.connect("mqtt",1883)
+        if self.stack:
+            self.mqtt_client.connect(self.stack.mqtt_host,self.stack.mqtt_port)
+        else:
+            self.mqtt_client.connect("mqtt",1883)
         self.mqtt_client.loop_start()
 
     def __init_mission_file(self) -> None:
@@ -201,15 +248,15 @@ class Fuzz_Testor():
             print("Connected to MQTT broker successfully!")
             #simple flag to control mqtt on message 
             self.message_sent = False
-            self.mqtt_client.subscribe([("update_drone",0),("fuzz_mission/ready",1)])
-            self.mqtt_client.message_callback_add("fuzz_mission/ready",self.mqtt_on_mission_ready)
-            self.mqtt_client.message_callback_add("update_drone",self.mqtt_on_message)
+            self.mqtt_client.subscribe([(self.update_topic,0),(self.ready_topic,1)])
+            self.mqtt_client.message_callback_add(self.ready_topic,self.mqtt_on_mission_ready)
+            self.mqtt_client.message_callback_add(self.update_topic,self.mqtt_on_message)
             self.mqtt_connected.set()
         else:
             print("Failed to connect to MQTT broker with return code: {}".format(rc))
     
     def __init_docker_interface(self) -> None:
-        self.docker_interface = Docker_Interface(self.mqtt_client,self.uav_id)
+        self.docker_interface = Docker_Interface(self.mqtt_client,self.uav_id,self.stack,self.warm_reset)
         self.docker_interface.run_onboard()
 
     def _abort_mission(self):
@@ -272,7 +319,56 @@ class Fuzz_Testor():
     def _start_mission_timer(self):
         print('[fuzz_tester] starting timer')
         self.mission_start_time = time.time()
+        if self.log_watcher is not None:
+            self.log_mark = self.log_watcher.mark()
+        if self.early_abort:
+            self._start_monitor()
         self.mission_time.set()
+        self.watchdog.schedule(self.uav_id, self.threshold, self._on_mission_timeout)
+
+    def _start_monitor(self):
+        '''
+        Start the in-flight monitor. With a shared log directory it follows the log PX4 is writing
+        (local position, land detected and freefall); otherwise it is fed from MAVROS (local
+        position and landed state; freefall is only seen in the log analysis afterwards).
+        '''
+        tree = get_blueprint(get_max_deviation.find_blueprint()).tree()
+        self.mission_failed.clear()
+        self.monitor = Deviation_Monitor(tree, on_failure=self._on_mission_failed)
+        if self.log_watcher is not None:
+            threading.Thread(target=self._follow_log, args=(self.monitor, self.log_mark), daemon=True).start()
+
+    def _follow_log(self, monitor, log_mark):
+        #PX4 opens the log when the vehicle arms, shortly after the mission starts
+        ulg_file_path = self.log_watcher.wait_for_open(log_mark, LOG_OPEN_TIMEOUT)
+        if ulg_file_path is None:
+            print('[fuzz_testor] no live log to follow, monitoring without freefall detection')
+            return
+        with self.critical_lock:
+            if self.monitor is monitor:
+                self.log_follower = Log_Follower(self.log_watcher.path(ulg_file_path), monitor).start()
+
+    def _stop_monitor(self):
+        self.monitor = None
+        if self.log_follower is not None:
+            self.log_follower.stop()
+            self.log_follower = None
+
+    def _on_mission_failed(self, reason):
+        print(f'[fuzz_testor] monitor flagged the mission as failed: {reason}')
+        self.mission_failed.set()
+        #bring the deadline forward instead of waiting out the threshold
+        self.watchdog.reschedule(self.uav_id, 0)
+
+    def update_monitor(self, timestamp, x, y, z):
+        monitor = self.monitor
+        if monitor is not None and self.mission_time.is_set():
+            monitor.update_position(timestamp, x, y, z)
+
+    def update_monitor_landed(self, timestamp, landed):
+        monitor = self.monitor
+        if monitor is not None and self.mission_time.is_set():
+            monitor.update_land_detected(timestamp, False, landed)
     
 
     def run_test(self,fuzz_test:Fuzz_Test):
@@ -290,8 +386,13 @@ class Fuzz_Testor():
         # Initialize ROS_Interface with throttle parameters if applicable
         self.ros_interface = ROS_Interface(
             throttle_value=throttle_value,
-            throttle_lock=throttle_lock
+            throttle_lock=throttle_lock,
+            namespace=self.stack.ros_namespace if self.stack else None
         )
+        if self.early_abort and self.log_watcher is None:
+            #with a shared log directory the monitor follows the live log instead
+            self.ros_interface.sub_local_position(self.update_monitor)
+            self.ros_interface.sub_extended_state(self.update_monitor_landed)
 
         # Set up geofence if applicable
         if fuzz_test.geofence:
@@ -308,32 +409,18 @@ class Fuzz_Testor():
             self.fuzz_type = fuzz_test.fuzz_type
             self.fuzz_test_combinations = fuzz_test.test_combinations
             self.mode_throttle_combos = fuzz_test.remove_states_from_combinations()
-        # self.load_executed_tests()
+        self.load_executed_tests()
         self.fuzz_test = fuzz_test 
         print('[fuzz_testor] preparing to send mission')
         self.enqueue_mqtt_message()
         return 
 
     def select_fuzz_test(self,current_state):
-        if "geo" in self.fuzz_type:
-            available_tests = self.fuzz_test_combinations - self.executed_tests
-        else:
-            if current_state not in self.fuzz_test.states:
-                return None 
-            tested = self.tested_modes_by_state.get(current_state,set())
-            available_tests = self.mode_throttle_combos - tested
-        if not available_tests:
-            return None 
-        return available_tests.pop()
+        return select_fuzz_test(self.fuzz_test, current_state, self.executed_tests,
+                                self.tested_modes_by_state, self.mode_throttle_combos)
 
     def execute_fuzz_test(self, fuzz_tuple):
-        command_dict = self.fuzz_test.populate_command(fuzz_tuple)
-        if "geo" in self.fuzz_type:
-            self.ros_interface.reset_fuzz_done_flag()
-            self.ros_interface.reset_geo_flag()
-            self.ros_interface.send_geo_commands(command_dict)
-        else:
-            self.ros_interface.send_command(command_dict)
+        execute_fuzz_test(self.fuzz_test, self.ros_interface, fuzz_tuple)
         return 
     '''
     Main function that relies on MQTT for fuzzing based on the drone state.
@@ -349,26 +436,31 @@ class Fuzz_Testor():
             if self.mission_abort.is_set():
                 return 
             if curr_state == "success":
+                self.watchdog.cancel(self.uav_id)
                 self.mission_time.clear()
-                ulg_file_path = self.docker_interface.get_latest_ulg_file()
-                self.save_contender_file(ulg_file_path)
-                self.write_to_file(ulg_file_path,self.recent_test,True)
-                self.save_executed_tests()
+                self._stop_monitor()
+                self.submit_analysis(True)
                 #force auto.land to reset in case of a manual switch
                 self.ros_interface.cleanup()
                 #record success and get ready for next mission 
                 self.enqueue_mqtt_message()
                 self.message_sent = False 
             else:
+                if self.flight_start is None:
+                    #the vehicle arms at the first state of the flight; injections are timed from here and the
+                    #analyzer lines them up with the arming recorded in the log (metrics.flight_start)
+                    self.flight_start = time.time()
                 #if we already sent a message don't send a HIT until next mission
-                if self.message_sent:
+                #(with several injections per flight: until the flight recovered from the last one)
+                if self.message_sent and not self._recovered(curr_state):
                     return 
                 #logic for selecting and executing fuzz tests 
                 fuzz_to_execute = self.select_fuzz_test(curr_state)
                 #if no fuzz to execute, means we finished all tests for that particular state, 
                 #now wait for the next state to test.
                 if not fuzz_to_execute:
-                    if self.executed_tests == self.fuzz_test_combinations:
+                    #injections of this flight are only recorded when it ends
+                    if self.executed_tests == self.fuzz_test_combinations and not self.message_sent:
                         print('[fuzz_testor] finished with all tests!')
                         
                         self.test_complete.set()
@@ -385,95 +477,120 @@ class Fuzz_Testor():
                 print(f'[fuzz_testor] executing {fuzz_to_execute}')
                 self.execute_fuzz_test(fuzz_to_execute)
                 #updating executed tests 
-                if "state" in self.fuzz_type:
-                    self.tested_modes_by_state.setdefault(curr_state, set()).add(fuzz_to_execute)
-                    executed_tuple = fuzz_to_execute + (curr_state,)
-                    self.executed_tests.add(executed_tuple)
-                    self.recent_test = executed_tuple 
-                elif "geo" in self.fuzz_type:
-                    self.executed_tests.add(fuzz_to_execute)
-                    self.recent_test = fuzz_to_execute
+                self.recent_test = mark_executed(self.fuzz_test, fuzz_to_execute, curr_state,
+                                                 self.executed_tests, self.tested_modes_by_state)
                 self.message_sent = True 
+                self.flight_injections.append((self.recent_test, curr_state, time.time()))
+
+    def _recovered(self, curr_state):
+        '''Whether the flight may take another injection (see fuzz_common.recovered).'''
+        return recovered(self.fuzz_type, self.flight_injections, self.injections_per_flight, curr_state,
+                         self.mission_failed.is_set(), self.recovery_window)
         
-    def check_time_threshold(self):
-        while True:
-            self.mission_time.wait()
-            if self.force_shutdown.is_set():
-                print('shutdown_handler] shutting down timing thread')
-                return 
-            mission_time = time.time() - self.mission_start_time
-            if mission_time >= self.threshold:
-                with self.critical_lock:
-                    if self.mission_time.is_set():
-                        self.mission_abort.set()
-                        print('[fuzz_testor] time exceeded, restarting state machine')
-                        ulg_file_path = self.docker_interface.get_latest_ulg_file()
-                        self.save_contender_file(ulg_file_path)
-                        self.write_to_file(ulg_file_path, self.recent_test, False)
-                        self.save_executed_tests()
-                        self._abort_mission()
-                        self._cleanup()
-                        self.mission_time.clear()
-                        self.mission_abort.clear()
-                        self.enqueue_mqtt_message()
-                        self.message_sent = False 
-                        # self.critical_lock.release()
+    def _on_mission_timeout(self, uav_id):
+        '''
+        Called by the watchdog when the mission deadline passes (or the monitor brought it forward):
+        records the failed mission, restarts the stack and queues the next mission.
+        '''
+        if self.force_shutdown.is_set():
+            return
+        with self.critical_lock:
+            if not self.mission_time.is_set():
+                return
+            self.mission_abort.set()
+            if self.mission_failed.is_set():
+                print('[fuzz_testor] mission failed early, restarting state machine')
+            else:
+                print('[fuzz_testor] time exceeded, restarting state machine')
+            self.submit_analysis(False)
+            self._abort_mission()
+            self._cleanup()
+            self.mission_time.clear()
+            self._stop_monitor()
+            self.mission_failed.clear()
+            self.mission_abort.clear()
+            self.enqueue_mqtt_message()
+            self.message_sent = False 
 
     '''
     Function to copy the log file from the px4 container into the fuzz service container.
+    Each log gets its own temporary directory so analyses of different missions never touch each other's files.
+    Returns the local path of the copied log.
     '''
     def save_contender_file(self, ulg_file_path):
-        source_container = "dr-onboardautonomy-px4"
-        source_id = os.popen(f"docker ps -qf name={source_container}").read().strip()
-        source_path = "/home/user/Firmware/build/px4_sitl_default/logs/"+ulg_file_path
-        destination_path = "/catkin_ws/src/fuzz_test_service/Fuzz/log_analyzer/contender_logs"
-        if len(glob.glob(destination_path + "/*.ulg")) != 0:
-            os.system("rm "+destination_path+"contender_logs/*")
-        os.system(f"docker cp {source_id}:{source_path} {destination_path}")
-
+        os.makedirs(CONTENDER_LOG_DIR, exist_ok=True)
+        destination_path = tempfile.mkdtemp(dir=CONTENDER_LOG_DIR)
+        return self.docker_interface.copy_log(ulg_file_path, destination_path)
 
-    def write_to_file(self, ulg_file_path, recent_test, mission_status):
+    def collect_log(self, ulg_file_path, log_mark, wait, contender=None):
         '''
-        Logs these things:
-        - the log file path, a tuple with the most recent fuzz test executed, and a Boolean for the mission completion 
-        - Run the log analyser to parse the ulog file for the fuzz mission and add max_deviation, max_altitude,duration, final_landing_state, freefall_occurred
+        Returns (log path relative to the PX4 log directory, local path to analyze) for a finished mission.
+        With a shared log directory the local path is the log itself, taken from the watcher
+        (waiting up to wait seconds for PX4 to close it); otherwise ulg_file_path is copied out of the container,
+        unless submit_analysis already copied it to contender.
         '''
-        # # Convert the tuple and JSON message to strings
-        # recent_test_str = str(recent_test)
-        # json_message_str = json.dumps(json_message)
-
-        # # Create a formatted message that includes all parts
-        # # This uses a simple comma-separated format. Adjust the separator if needed.
-        # formatted_message = f"{ulg_file_path}, {recent_test_str}, {json_message_str}, \n"
-
-        # # Write the formatted message to the file
-        # with open("Fuzz_Test_Logs.txt", 'a') as f:
-        #     f.write(formatted_message)
-        # print('Calling Write to file')
-
-        max_difference, max_altitude, duration, end_land_status, freefall_occurred = get_max_deviation.log_parser()
-
-        # Convert the tuple and JSON message to strings
-        recent_test_str = str(recent_test)
-
-        json_object = {
-            "filename": ulg_file_path,
-            "mission": recent_test_str,
-            "max_deviation": max_difference,
-            "max_altitude": max_altitude,
-            "duration": duration,
-            "final_landing_state": end_land_status,
-            "freefall_occurred": freefall_occurred,
-            "mission_complete": mission_status
-        }
-
-        json_output = json.dumps(json_object, indent=4)
+        if self.log_watcher is None:
+            return ulg_file_path, contender or self.save_contender_file(ulg_file_path)
+        ulg_file_path = self.log_watcher.wait_for_log(log_mark, wait)
+        if ulg_file_path is None:
+            print('[fuzz_testor] no log was written for this mission')
+            return None, None
+        return ulg_file_path, self.log_watcher.path(ulg_file_path)
 
-        self.output = json_output
 
-        # Write the formatted message to the file
-        with open("Fuzz_Test_Logs.txt", 'a') as f:
-            f.write(json_output)
+    def submit_analysis(self, mission_status):
+        '''
+        Hand the finished mission to the analysis worker, so the next mission is published without
+        waiting for the log copy and analysis. Called under critical_lock: only the log location
+        is resolved here (the latest log must be found before the next mission starts a new one),
+        and the test tuple is captured for the worker to record with the result.
+        A failed mission is followed by a reset of the PX4 container, so its log is copied out here,
+        before _abort_mission, instead of by the worker while the container restarts.
+        '''
+        ulg_file_path = self.docker_interface.get_latest_ulg_file() if self.log_watcher is None else None
+        contender = None
+        if not mission_status and ulg_file_path is not None:
+            try:
+                contender = self.save_contender_file(ulg_file_path)
+            except Exception as e:
+                #the worker tries again after the reset
+                print(f'[fuzz_testor] copying {ulg_file_path} before the reset failed: {e}')
+        injections = injection_offsets(self.flight_injections, self.flight_start)
+        self.analysis_queue.put((ulg_file_path, self.log_mark, self.recent_test, mission_status, injections, contender))
+        self.flight_injections = []
+        self.flight_start = None
+
+    def analysis_worker(self):
+        while True:
+            job = self.analysis_queue.get()
+            if job is None:
+                self.analysis_queue.task_done()
+                return
+            ulg_file_path, log_mark, recent_test, mission_status, injections, contender = job
+            try:
+                #a timed-out flight may still be logging, so its log is read as it is instead of waiting for it to close
+                ulg_file_path, contender = self.collect_log(ulg_file_path, log_mark, LOG_CLOSE_TIMEOUT if mission_status else 0, contender)
+                for record in mission_records(ulg_file_path, recent_test, injections, mission_status, contender, self.log_watcher is not None):
+                    self.record(record)
+                tests = [test for test, _ in injections] if len(injections) > 1 else [recent_test]
+                #journaled after their results, so a resumed campaign re-flies a test whose result was lost
+                for test in tests:
+                    if test is not None:
+                        self.save_executed_tests(test)
+            except Exception as e:
+                print(f'[fuzz_testor] analysis of {recent_test} failed: {e}')
+            finally:
+                self.analysis_queue.task_done()
+
+    def wait_for_analysis(self):
+        '''Block until every submitted mission is analyzed and recorded.'''
+        self.analysis_queue.join()
+
+    def record(self, json_object):
+        '''Store a result record (see fuzz_common.make_record for its layout).'''
+        self.output = json.dumps(json_object, indent=4)
+
+        self.result_store.append(json_object, self.uav_id)
         return
     
     def submit_test(self, test):
@@ -498,17 +615,25 @@ class Fuzz_Testor():
     '''
     Functions below gracefully shutdown all running processes and threads.
     signal_handler - recieves interrupt and shutdowns rospy, docker, and timer
-    shutdown_timer - sets events to exit timer thread
+    shutdown_timer - sets events and drops the mission deadline
     '''
     def trigger_shutdown(self):
         # os.kill(os.getpid(), signal.SIGINT)
         print('[shutdown_handler] forcing exit of all threads ....')
         self.shutdown_timer()
+        #results of the last missions are still being analyzed
+        self.wait_for_analysis()
+        self.analysis_queue.put(None)
         # self.ros_interface.shutdown()
         self.ros_interface.reset_attributes()
         print('[shutdown_handler] successfully shutdown rospy')
         self.docker_interface.abort_mission()
         print('[shutdown_handler] successfully shutdown docker')
+        print('[shutdown_handler] reset latencies:', self.docker_interface.reset_summary())
+        self.result_store.close()
+        self.test_journal.close()
+        if self.log_watcher is not None:
+            self.log_watcher.stop()
         self.mqtt_client.loop_stop()
         return
 
@@ -516,8 +641,11 @@ class Fuzz_Testor():
         self.handle_shutdown()
 
     def shutdown_timer(self):
-        self.mission_time.set() 
         self.force_shutdown.set()
+        if self.owns_watchdog:
+            self.watchdog.stop()
+        else:
+            self.watchdog.cancel(self.uav_id)
         return 
 
     def handle_shutdown(self):
@@ -530,26 +658,27 @@ class Fuzz_Testor():
         sys.exit(0) 
 
 
-# print('Repetition - ', i)
-fuzz_testor = Fuzz_Testor()
-fuzz_test = Fuzz_Test(
-    drone_id="Polkadot",
-    geofence=[3],
-    throttle=[2])
-fuzz_testor.run_test(fuzz_test)
-fuzz_testor.test_complete.wait()
-fuzz_testor.trigger_shutdown()
- 
-for i in range(30):
-    print('Repetition - ', i)
+if __name__ == '__main__':
+    # print('Repetition - ', i)
     fuzz_testor = Fuzz_Testor()
     fuzz_test = Fuzz_Test(
         drone_id="Polkadot",
-        states=['Land'],
+        geofence=[3],
         throttle=[2])
     fuzz_testor.run_test(fuzz_test)
     fuzz_testor.test_complete.wait()
     fuzz_testor.trigger_shutdown()
+ 
+    for i in range(30):
+        print('Repetition - ', i)
+        fuzz_testor = Fuzz_Testor()
+        fuzz_test = Fuzz_Test(
+            drone_id="Polkadot",
+            states=['Land'],
+            throttle=[2])
+        fuzz_testor.run_test(fuzz_test)
+        fuzz_testor.test_complete.wait()
+        fuzz_testor.trigger_shutdown()
 # # fuzz_testor.executed_tests = set()
 
 # fuzz_testor = Fuzz_Testor()
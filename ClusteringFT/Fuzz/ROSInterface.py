@@ -1,10 +1,22 @@
 import rospy 
 from mavros_msgs.srv import SetMode, CommandBool, ParamPull, ParamPush, ParamGet, ParamSet, CommandLong,CommandBool
 from mavros_msgs.msg import State, ParamValue, ManualControl, ExtendedState, StatusText
+from geometry_msgs.msg import PoseStamped
 import threading 
 import time 
 
 SEND_CMD = 'mavros/cmd/command'
+#ROS node name; it is made anonymous (a pid/time suffix is added) since a node started under
+#the name of a running one shuts that one down, e.g. the testor of another vehicle on a shared master
+NODE_NAME = "Fuzz_Tester"
+
+def init_node():
+    '''
+    Start this process's ROS node. rospy allows one node per process, so all vehicles a process
+    flies share it; calling this again is a no-op.
+    '''
+    rospy.init_node(NODE_NAME, anonymous=True)
+
 class ROS_Interface:
     COMMAND_KILL = 'kill'
     COMMAND_MODE_SWITCH = 'mode_switch'
@@ -13,11 +25,13 @@ class ROS_Interface:
     
     
 
-    def __init__(self,throttle_value,throttle_lock):
-        rospy.init_node("Fuzz_Tester")
+    def __init__(self,throttle_value,throttle_lock,namespace=None):
+        init_node()
         self.throttle_value = throttle_value
         self.throttle_lock = throttle_lock 
-        self.send_cmd = rospy.ServiceProxy(SEND_CMD,CommandLong,persistent=True)
+        #MAVROS namespace of the vehicle (e.g. "uav1"), so several vehicles can share one ROS node
+        self.namespace = namespace
+        self.send_cmd = rospy.ServiceProxy(self._name(SEND_CMD),CommandLong,persistent=True)
         
 
         #initialization 
@@ -34,6 +48,11 @@ class ROS_Interface:
             self.throttle_thread = threading.Thread(target=self.manual_control_sender)
             self.throttle_thread.start()
 
+    def _name(self, name):
+        if not self.namespace:
+            return name
+        return '/' + self.namespace.strip('/') + '/' + name.lstrip('/')
+
     def init_services(self):
         self.services = {
             'set_param': ('mavros/param/set', ParamSet),
@@ -43,6 +62,7 @@ class ROS_Interface:
             'arm': ('mavros/cmd/arming', CommandBool)
         }
         for key, (topic, srv_type) in self.services.items():
+            topic = self._name(topic)
             try:
                 rospy.wait_for_service(topic, timeout=5)  # Wait for the service to become available
                 # Use setattr to dynamically create a service proxy
@@ -54,10 +74,10 @@ class ROS_Interface:
                 print(f"Failed to connect to {key} service at {topic}: {str(e)}")
 
     def init_publishers(self):
-        self.manual_control_publisher = rospy.Publisher('/mavros/manual_control/send', ManualControl, queue_size=10)
+        self.manual_control_publisher = rospy.Publisher(self._name('/mavros/manual_control/send'), ManualControl, queue_size=10)
 
     def init_subscribers(self):
-        rospy.Subscriber('/mavros/state', State, self.state_callback)
+        rospy.Subscriber(self._name('/mavros/state'), State, self.state_callback)
 
     def init_vars_geofence(self):
         self.geo_tests = None 
@@ -84,7 +104,30 @@ class ROS_Interface:
 
     def sub_geo_breach(self):
         topic_exists = rospy.search_param('/mavros/statustext/recv')
-        rospy.Subscriber('/mavros/statustext/recv', StatusText, self.geofence_breach_callback)
+        rospy.Subscriber(self._name('/mavros/statustext/recv'), StatusText, self.geofence_breach_callback)
+        return 
+
+    def sub_local_position(self, callback):
+        '''
+        Subscribe to the live local position. MAVROS publishes it in ENU, the callback
+        receives it in the NED frame used by PX4 logs: callback(timestamp_us, x, y, z).
+        '''
+        def pose_callback(msg):
+            position = msg.pose.position
+            timestamp = int(msg.header.stamp.to_nsec() / 1000)
+            callback(timestamp, position.y, position.x, -position.z)
+        self.local_position_sub = rospy.Subscriber(self._name('/mavros/local_position/pose'), PoseStamped, pose_callback)
+        return 
+
+    def sub_extended_state(self, callback):
+        '''
+        Subscribe to the live landed state: callback(timestamp_us, landed).
+        MAVROS does not relay PX4's freefall detection, only the landed state.
+        '''
+        def extended_state_callback(msg):
+            timestamp = int(msg.header.stamp.to_nsec() / 1000)
+            callback(timestamp, msg.landed_state == ExtendedState.LANDED_STATE_ON_GROUND)
+        self.extended_state_sub = rospy.Subscriber(self._name('/mavros/extended_state'), ExtendedState, extended_state_callback)
         return 
 
     def state_callback(self, data):
@@ -187,7 +230,7 @@ class ROS_Interface:
         #     self.running = False
         #     self.throttle_thread.join()
 
-        rospy.init_node("Fuzz_Tester")
+        init_node()
 
         #initialization 
         self.init_services()
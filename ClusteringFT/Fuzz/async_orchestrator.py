@@ -0,0 +1,471 @@
+import argparse
+import asyncio
+import copy
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+from campaign import Vehicle_Stack, load_stacks, shard_combinations, CAMPAIGN_RESULTS_FILE
+from DockerInterface import PX4_LOG_DIR, LATEST_ULG_COMMAND, WARM_RESET_TIMEOUT, warm_reset_command, snapshot_command, summarize_latencies
+from fuzz_common import (MQTT_MISSION, CONTENDER_LOG_DIR, LOG_CLOSE_TIMEOUT, RECOVERY_WINDOW, select_fuzz_test, execute_fuzz_test,
+    mark_executed, recovered, injection_offsets, mission_records)
+from log_watcher import Log_Watcher
+from result_store import Result_Store
+
+'''
+asyncio orchestration mode.
+
+One event loop drives the missions of any number of vehicles:
+- Async_MQTT hands paho's network-thread callbacks to the loop, so every message is
+  consumed by a coroutine instead of doing work inside the callback,
+- Async_Docker runs every docker command as an asyncio subprocess (with a Vehicle_Stack.log_dir
+  mount the log is taken from a Log_Watcher instead of copied),
+- log analysis runs in a process pool and blocking ROS service calls in the loop's
+  default thread pool, so no coroutine ever blocks the loop (and there is no critical_lock).
+A mission deadline is a plain asyncio.wait_for around the flight.
+
+Run from the Fuzz directory (one stack per line of stacks.json, see campaign.Vehicle_Stack):
+    python async_orchestrator.py --stacks stacks.json --geofence 3 --throttle 2
+Vehicles that share a ROS master need their own ros_namespace.
+'''
+
+MISSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "missions", "FUZZ_MISSION.json")
+MISSION_THRESHOLD = 75
+
+class Async_MQTT:
+    '''
+    paho client driven from asyncio. paho keeps its network thread, but its callbacks only
+    schedule work on the event loop: connect resolves a future and every message is put on
+    the asyncio.Queue of each subscription that matches it.
+    '''
+
+    def __init__(self, client_id, host="mqtt", port=1883):
+        self.host = host
+        self.port = port
+        self.client = mqtt.Client(client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self._subscriptions = defaultdict(list)
+        self._qos = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._connected = None
+
+    async def connect(self):
+        self._loop = asyncio.get_running_loop()
+        self._connected = self._loop.create_future()
+        self.client.connect_async(self.host, self.port)
+        self.client.loop_start()
+        await self._connected
+
+    def subscribe(self, topic, qos=0):
+        '''Return a queue that receives every message published on topic (wildcards allowed).'''
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscriptions[topic].append(queue)
+            self._qos[topic] = max(qos, self._qos.get(topic, 0))
+        self.client.subscribe(topic, qos)
+        return queue
+
+    def publish(self, topic, payload, qos=0):
+        # paho only queues the packet here, its network thread sends it
+        self.client.publish(topic, payload, qos=qos)
+
+    def disconnect(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        def resolve():
+            if self._connected.done():
+                return
+            if rc == 0:
+                self._connected.set_result(True)
+            else:
+                self._connected.set_exception(ConnectionError(f'[async_orchestrator] MQTT connect failed with return code {rc}'))
+        self._loop.call_soon_threadsafe(resolve)
+        if rc == 0:
+            # resubscribe after a reconnect
+            with self._lock:
+                for topic in self._subscriptions:
+                    client.subscribe(topic, self._qos[topic])
+
+    def _on_message(self, client, userdata, msg):
+        with self._lock:
+            queues = [queue for topic, topic_queues in self._subscriptions.items()
+                      if mqtt.topic_matches_sub(topic, msg.topic) for queue in topic_queues]
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, msg)
+
+class Async_Docker:
+    '''Docker_Interface on asyncio subprocesses, for one vehicle stack.'''
+
+    def __init__(self, mqtt_client, uav_id, stack=None, warm_reset=False):
+        self.mqtt_client = mqtt_client
+        self.uav_id = uav_id
+        self.stack = stack
+        mqtt_host = stack.mqtt_host if stack else "mqtt"
+        local_mqtt_host = stack.local_mqtt_host if stack else "mqtt_local"
+        self.abort_topic = stack.abort_topic if stack else "all-drones/abort"
+        self.state_machine_start = f"cd /catkin_ws/src/dr_onboard_autonomy/src/dr_onboard_autonomy && python state_machine.py _uav_name:={uav_id} _mqtt_host:={mqtt_host} _local_mqtt_host:={local_mqtt_host}"
+        self.dev_image_id = "dr-onboardautonomy-vs-code"
+        self.px4_image_id = "dr-onboardautonomy-px4"
+        self.airlease_id = "microservice-air-lease-air-lease"
+        self.state_machine_container = None
+        self.px4_container = None
+        self.airlease = None
+        self.process = None
+        self.warm_reset = warm_reset or bool(stack and stack.warm_reset)
+        self.reset_latencies = defaultdict(list)
+
+    async def setup(self):
+        '''Resolve the stack's containers (explicit names win over the image lookup).'''
+        stack = self.stack
+        self.state_machine_container, self.px4_container, self.airlease = await asyncio.gather(
+            self._container(stack and stack.state_machine_container, self.dev_image_id),
+            self._container(stack and stack.px4_container, self.px4_image_id),
+            self._container(stack and stack.airlease_container, self.airlease_id)
+        )
+        if self.warm_reset:
+            returncode, _ = await self._docker("exec", self.px4_container, "/bin/bash", "-c", snapshot_command())
+            if returncode != 0:
+                print(f'[async_docker] {self.uav_id} parameter snapshot failed, using cold resets')
+                self.warm_reset = False
+
+    async def _container(self, name, image_id):
+        if name:
+            return name
+        returncode, output = await self._docker("ps", "--filter", f"ancestor={image_id}", "--format", "{{.ID}}")
+        container = output.strip().split("\n")[0] if returncode == 0 else ""
+        if not container:
+            print(f"[async_docker] No running containers found for image {image_id}.")
+            return None
+        return container
+
+    async def _docker(self, *args, timeout=None):
+        process = await asyncio.create_subprocess_exec(
+            "docker", *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            print(f"[async_docker] docker {args[0]} timed out")
+            return None, ""
+        if process.returncode != 0 and stderr:
+            print(f"[async_docker] docker {args[0]} failed: {stderr.decode().strip()}")
+        return process.returncode, stdout.decode()
+
+    async def run_onboard(self):
+        # detached like the threaded version: the state machine runs until abort_mission kills it
+        self.process = await asyncio.create_subprocess_exec(
+            "docker", "exec", self.state_machine_container, "/bin/bash", "-c", self.state_machine_start,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL, start_new_session=True)
+        print(f'[async_docker] {self.uav_id} state machine process started with PID:', self.process.pid)
+
+    async def abort_mission(self):
+        self.mqtt_client.publish(self.abort_topic, "Shutdown", qos=1)
+        returncode, _ = await self._docker("exec", self.state_machine_container, "pkill", "-f", f"state_machine.py _uav_name:={self.uav_id}")
+        if returncode == 1:
+            print('[async_docker] No process found to kill.')
+        if self.warm_reset and await self.warm_reset_px4():
+            return
+        start = time.monotonic()
+        await self._docker("stop", self.px4_container)
+        await self._docker("restart", self.airlease)
+        await self._docker("start", self.px4_container)
+        self._record_reset("cold", start)
+
+    async def warm_reset_px4(self):
+        '''Reset PX4 in place while the air-lease service restarts; False if the containers need a restart.'''
+        start = time.monotonic()
+        (returncode, _), (airlease_returncode, _) = await asyncio.gather(
+            self._docker("exec", self.px4_container, "/bin/bash", "-c", warm_reset_command(), timeout=WARM_RESET_TIMEOUT),
+            self._docker("restart", self.airlease)
+        )
+        if returncode != 0 or airlease_returncode != 0:
+            print(f'[async_docker] {self.uav_id} warm reset failed, falling back to a container restart')
+            self._record_reset("warm_failed", start)
+            return False
+        self._record_reset("warm", start)
+        return True
+
+    def _record_reset(self, path, start):
+        latency = time.monotonic() - start
+        self.reset_latencies[path].append(latency)
+        print(f'[async_docker] {self.uav_id} {path} reset took {latency:.2f}s')
+
+    async def get_latest_ulg_file(self):
+        returncode, output = await self._docker("exec", self.px4_container, "/bin/bash", "-c", LATEST_ULG_COMMAND)
+        return output.strip() if returncode == 0 else None
+
+    async def copy_log(self, ulg_file_path):
+        '''docker cp the log into its own temporary directory and return the local path.'''
+        os.makedirs(CONTENDER_LOG_DIR, exist_ok=True)
+        destination = tempfile.mkdtemp(dir=CONTENDER_LOG_DIR)
+        await self._docker("cp", f"{self.px4_container}:{PX4_LOG_DIR}{ulg_file_path}", destination)
+        return os.path.join(destination, os.path.basename(ulg_file_path))
+
+class Async_Fuzz_Testor:
+    '''
+    One vehicle's fuzz test as a coroutine; any number of them can share an event loop,
+    an Async_MQTT connection and an analysis executor.
+
+    Args:
+        fuzz_test (Fuzz_Test): Test (or campaign shard) to fly.
+        mqtt_client (Async_MQTT): Connected client for the vehicle's broker.
+        executor (Executor): Pool the log analysis runs in.
+        stack (Vehicle_Stack): The vehicle. None for the default single stack.
+        ros_interface_factory (Callable): Builds the vehicle's ROS_Interface. Defaults to ROS_Interface.
+        threshold (float): Seconds before a mission counts as failed.
+        warm_reset (bool): Reset PX4 in place on abort, restarting the containers only if that fails.
+        injections_per_flight (int): State fuzzing only: inject up to this many tests per flight,
+            each once the flight recovered from the previous one (see fuzz_common.recovered).
+        recovery_window (float): Seconds a flight must run on after an injection before the next one.
+    '''
+
+    def __init__(self, fuzz_test, mqtt_client, executor, stack=None, ros_interface_factory=None, threshold=MISSION_THRESHOLD, warm_reset=False,
+                 injections_per_flight=1, recovery_window=RECOVERY_WINDOW):
+        self.fuzz_test = fuzz_test
+        self.mqtt = mqtt_client
+        self.executor = executor
+        self.stack = stack
+        self.uav_id = stack.uav_id if stack else fuzz_test.drone_id
+        self.update_topic = stack.update_topic if stack else "update_drone"
+        self.ready_topic = stack.ready_topic if stack else "fuzz_mission/ready"
+        self.ros_interface_factory = ros_interface_factory
+        self.threshold = threshold
+        self.docker = Async_Docker(mqtt_client, self.uav_id, stack, warm_reset)
+        #stack.log_dir: logs come from a watcher on the shared PX4 log directory and are analyzed in place
+        self.log_watcher = Log_Watcher(stack.log_dir) if stack and stack.log_dir else None
+        self.log_mark = 0
+        self.result_store = Result_Store()
+        self.fuzz_type = fuzz_test.fuzz_type
+        self.fuzz_test_combinations = fuzz_test.test_combinations
+        self.injections_per_flight = injections_per_flight
+        self.recovery_window = recovery_window
+        self.executed_tests = set()
+        self.tested_modes_by_state = defaultdict(set)
+        self.mode_throttle_combos = set()
+        self.recent_test = None
+        #injections of the current flight as (test, state, time), and when the flight (and its log) started
+        self.flight_injections = []
+        self.flight_start = None
+        self.records = []
+        #analysis tasks of flown missions that have not been written yet
+        self.pending = []
+        with open(MISSION_FILE, 'r') as f:
+            self.mission_file = json.load(f)
+
+    async def _blocking(self, function, *args):
+        # ROS service calls block, so they run in the loop's default thread pool
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def _make_ros_interface(self):
+        if self.ros_interface_factory is not None:
+            return self.ros_interface_factory(self)
+        from ROSInterface import ROS_Interface
+        throttle_lock = threading.Lock() if self.fuzz_test.throttle else None
+        ros_interface = ROS_Interface(
+            throttle_value=None,
+            throttle_lock=throttle_lock,
+            namespace=self.stack.ros_namespace if self.stack else None
+        )
+        if self.fuzz_test.geofence:
+            ros_interface.toggle_geofence(20.0)
+            ros_interface.sub_geo_breach()
+        else:
+            ros_interface.toggle_geofence(0.0)
+        return ros_interface
+
+    def finished(self):
+        return self.executed_tests >= set(self.fuzz_test_combinations)
+
+    async def run(self):
+        '''Fly missions until every combination has been executed; returns the result records.'''
+        updates = self.mqtt.subscribe(self.update_topic, 0)
+        self.ready = self.mqtt.subscribe(self.ready_topic, 1)
+        await self.docker.setup()
+        await self.docker.run_onboard()
+        if self.ros_interface_factory is None:
+            # init_node installs signal handlers, which only works on the main thread (the loop's);
+            # the call ROS_Interface makes on the executor thread then returns at once
+            from ROSInterface import init_node
+            init_node()
+        self.ros_interface = await self._blocking(self._make_ros_interface)
+        if "state" in self.fuzz_type:
+            self.mode_throttle_combos = self.fuzz_test.remove_states_from_combinations()
+        mission_ready = False
+        while not self.finished():
+            if not mission_ready:
+                await self.ready.get()
+                print(f'[async_fuzz_testor] {self.uav_id} received mission ready')
+            mission_ready = await self.fly_mission(updates)
+        await asyncio.gather(*self.pending)
+        if self.log_watcher is not None:
+            self.log_watcher.stop()
+        self.result_store.close()
+        print(f'[async_fuzz_testor] {self.uav_id} finished with all tests!')
+        print(f'[async_fuzz_testor] {self.uav_id} reset latencies:', summarize_latencies(self.docker.reset_latencies))
+        return self.records
+
+    async def fly_mission(self, updates):
+        '''
+        Publish the mission and fuzz it until it succeeds or runs past the threshold.
+        Returns True if the state machine is still ready for the next mission.
+        '''
+        await asyncio.sleep(2)
+        while not updates.empty():
+            updates.get_nowait()
+        if self.log_watcher is not None:
+            self.log_mark = self.log_watcher.mark()
+        self.mqtt.publish(MQTT_MISSION.format(self.uav_id), json.dumps(self.mission_file))
+        print(f'[async_fuzz_testor] {self.uav_id} published mission')
+        try:
+            await asyncio.wait_for(self._fuzz_until_success(updates), self.threshold)
+            success = True
+        except asyncio.TimeoutError:
+            print(f'[async_fuzz_testor] {self.uav_id} time exceeded, restarting state machine')
+            success = False
+
+        # the log is copied before the next mission (or the PX4 restart) starts a new one
+        self.pending.append(await self.record_mission(success))
+        if success:
+            await self._blocking(self.ros_interface.cleanup)
+            return True
+        await self.docker.abort_mission()
+        await self._blocking(self.ros_interface.cleanup)
+        await asyncio.sleep(1)
+        # readiness announced by the previous state machine no longer applies
+        while not self.ready.empty():
+            self.ready.get_nowait()
+        await self.docker.run_onboard()
+        return False
+
+    async def _fuzz_until_success(self, updates):
+        message_sent = False
+        while True:
+            msg = await updates.get()
+            status = json.loads(msg.payload)["status"]
+            if status == "success":
+                return
+            curr_state = status["state_name"]
+            if self.flight_start is None:
+                #injections are timed from the first state of the flight, like in Fuzz_Testor
+                self.flight_start = time.time()
+            if message_sent and not recovered(self.fuzz_type, self.flight_injections, self.injections_per_flight,
+                                              curr_state, recovery_window=self.recovery_window):
+                continue
+            fuzz_to_execute = select_fuzz_test(self.fuzz_test, curr_state, self.executed_tests,
+                                               self.tested_modes_by_state, self.mode_throttle_combos)
+            if not fuzz_to_execute:
+                continue
+            print(f'[async_fuzz_testor] {self.uav_id} executing {fuzz_to_execute}')
+            await self._blocking(execute_fuzz_test, self.fuzz_test, self.ros_interface, fuzz_to_execute)
+            self.recent_test = mark_executed(self.fuzz_test, fuzz_to_execute, curr_state,
+                                             self.executed_tests, self.tested_modes_by_state)
+            self.flight_injections.append((self.recent_test, curr_state, time.time()))
+            message_sent = True
+
+    async def record_mission(self, mission_status):
+        '''
+        Copy the mission log (or take it from the shared log directory) and return a task that analyzes it in the executor and
+        writes the records, so the next mission does not wait for the analysis.
+        '''
+        recent_test = self.recent_test
+        injections = injection_offsets(self.flight_injections, self.flight_start)
+        self.flight_injections = []
+        self.flight_start = None
+        in_place = self.log_watcher is not None
+        if in_place:
+            # a timed-out flight is still being logged, so it is read as it is
+            ulg_file_path = await self._blocking(self.log_watcher.wait_for_log, self.log_mark, LOG_CLOSE_TIMEOUT if mission_status else 0)
+            contender = self.log_watcher.path(ulg_file_path) if ulg_file_path else None
+        else:
+            ulg_file_path = await self.docker.get_latest_ulg_file()
+            contender = await self.docker.copy_log(ulg_file_path)
+        async def record():
+            # a failed analysis is logged and skipped like in Fuzz_Testor.analysis_worker, it does not abort the run
+            try:
+                return await analyze_and_write()
+            except Exception as e:
+                print(f'[async_fuzz_testor] {self.uav_id} analysis of {recent_test} failed: {e}')
+                return None
+        async def analyze_and_write():
+            loop = asyncio.get_running_loop()
+            records = await loop.run_in_executor(self.executor, mission_records, ulg_file_path, recent_test, injections,
+                                                 mission_status, contender, in_place)
+            for json_object in records:
+                self.output = json.dumps(json_object, indent=4)
+                self.result_store.append(json_object, self.uav_id)
+                json_object["uav_id"] = self.uav_id
+                self.records.append(json_object)
+            return records
+        return asyncio.ensure_future(record())
+
+async def orchestrate(fuzz_test, stacks=None, workers=None, output=CAMPAIGN_RESULTS_FILE, warm_reset=False, injections_per_flight=1):
+    '''
+    Fly fuzz_test on every stack from one event loop (sharded like campaign.Campaign_Runner)
+    and return the merged records. Stacks on the same broker share one MQTT connection.
+    '''
+    stacks = stacks or [Vehicle_Stack(uav_id=fuzz_test.drone_id)]
+    clients = {}
+    for stack in stacks:
+        key = (stack.mqtt_host, stack.mqtt_port)
+        if key not in clients:
+            clients[key] = Async_MQTT(f"Fuzzing_System_async_{len(clients)}", stack.mqtt_host, stack.mqtt_port)
+    await asyncio.gather(*(client.connect() for client in clients.values()))
+
+    testors = []
+    for stack, combinations in zip(stacks, shard_combinations(fuzz_test.test_combinations, len(stacks))):
+        if not combinations:
+            continue
+        shard = copy.copy(fuzz_test)
+        shard.test_combinations = combinations
+        client = clients[(stack.mqtt_host, stack.mqtt_port)]
+        testors.append(Async_Fuzz_Testor(shard, client, executor=None, stack=stack, warm_reset=warm_reset,
+                                         injections_per_flight=injections_per_flight))
+
+    try:
+        # spawned, not forked: a fork would copy the paho network thread's and the loop's locks mid-use
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            for testor in testors:
+                testor.executor = executor
+            results = await asyncio.gather(*(testor.run() for testor in testors))
+    finally:
+        for client in clients.values():
+            client.disconnect()
+
+    records = [record for stack_records in results for record in stack_records]
+    if output is not None:
+        with open(output, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    return records
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fly a fuzz test on one or more vehicles from a single asyncio event loop.")
+    parser.add_argument('--stacks', default=None, help='JSON list of Vehicle_Stack fields (default: the single local stack).')
+    parser.add_argument('--workers', type=int, default=None, help='Log analysis processes.')
+    parser.add_argument('--output', default=CAMPAIGN_RESULTS_FILE)
+    parser.add_argument('--warm-reset', action='store_true', help='Reset PX4 in place on abort instead of restarting its container.')
+    parser.add_argument('--injections-per-flight', type=int, default=1, help='State fuzzing: tests injected per flight, each after the flight recovered from the previous one.')
+    parser.add_argument('--drone-id', default="Polkadot")
+    parser.add_argument('--modes', nargs='*', default=[])
+    parser.add_argument('--states', nargs='*', default=[])
+    parser.add_argument('--geofence', nargs='*', type=int, default=[])
+    parser.add_argument('--throttle', nargs='*', type=int, default=[])
+    args = parser.parse_args()
+
+    from entities import Fuzz_Test
+    fuzz_test = Fuzz_Test(drone_id=args.drone_id, modes=args.modes, states=args.states,
+                          geofence=args.geofence, throttle=args.throttle)
+    stacks = load_stacks(args.stacks) if args.stacks else None
+    asyncio.run(orchestrate(fuzz_test, stacks, args.workers, args.output, args.warm_reset, args.injections_per_flight))
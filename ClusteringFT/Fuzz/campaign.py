@@ -0,0 +1,240 @@
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Optional
+
+from log_analyzer import get_max_deviation
+from result_store import RESULT_STORE, Result_Store
+
+'''
+Multi-vehicle fuzz campaigns.
+
+A campaign shards the test_combinations of one Fuzz_Test across N isolated vehicle
+stacks and flies the shards in parallel, one process per stack (rospy allows a single
+node per process, and every stack has its own ROS master, MQTT broker/topics and
+containers). The per-stack results are merged into one JSONL file tagged with the uav_id.
+
+Run from the Fuzz directory, e.g. with the local stand-in instead of real vehicles:
+    python campaign.py --stand-in 4 --geofence 1 2 3 4 5 --modes ALTCTL POSCTL
+or against real stacks described in a JSON list of Vehicle_Stack fields:
+    python campaign.py --stacks stacks.json --states Takeoff Land --throttle 1 2
+'''
+
+#merged results of all stacks, one JSON record per line
+CAMPAIGN_RESULTS_FILE = "campaign_results.jsonl"
+#parent of the per-stack working directories
+CAMPAIGN_DIR = "campaign"
+
+@dataclass
+class Vehicle_Stack:
+    '''
+    One isolated simulated vehicle.
+
+    Container fields left as None are looked up by image, like the single-vehicle setup,
+    so they must be set whenever more than one stack runs on the same docker host.
+
+    Args:
+        uav_id (str): Vehicle name, used for the state machine and the mission topic.
+        mqtt_host (str): MQTT broker the stack's state machine talks to.
+        mqtt_port (int): MQTT broker port.
+        local_mqtt_host (str): Onboard (local) MQTT broker of the state machine.
+        update_topic (str): Topic the state machine publishes its state on.
+        ready_topic (str): Topic the state machine publishes mission-ready on.
+        abort_topic (str): Topic used to abort the stack's mission.
+        state_machine_container (str): Container running the onboard state machine.
+        px4_container (str): Container running PX4 SITL.
+        airlease_container (str): Container running the air-lease service.
+        ros_master_uri (str): ROS master of the stack's MAVROS.
+        ros_namespace (str): MAVROS namespace of the stack, for vehicles sharing one ROS master.
+        workdir (str): Working directory for the stack's result and executed-test files.
+        warm_reset (bool): Reset the vehicle inside the running containers on abort (see Docker_Interface).
+        log_dir (str): Local mount of the stack's PX4 log directory. Logs are then analyzed in place
+            instead of copied out of the container (see log_watcher.py).
+    '''
+    uav_id: str
+    mqtt_host: str = "mqtt"
+    mqtt_port: int = 1883
+    local_mqtt_host: str = "mqtt_local"
+    update_topic: str = "update_drone"
+    ready_topic: str = "fuzz_mission/ready"
+    abort_topic: str = "all-drones/abort"
+    state_machine_container: Optional[str] = None
+    px4_container: Optional[str] = None
+    airlease_container: Optional[str] = None
+    ros_master_uri: Optional[str] = None
+    ros_namespace: Optional[str] = None
+    workdir: Optional[str] = None
+    warm_reset: bool = False
+    log_dir: Optional[str] = None
+
+    def working_directory(self):
+        return self.workdir or os.path.join(CAMPAIGN_DIR, self.uav_id)
+
+    def environment(self):
+        return {"ROS_MASTER_URI": self.ros_master_uri} if self.ros_master_uri else {}
+
+def load_stacks(file_path):
+    with open(file_path, 'r') as f:
+        return [Vehicle_Stack(**stack) for stack in json.load(f)]
+
+def shard_combinations(test_combinations, count):
+    '''Split the combinations round-robin into count disjoint sets, in a fixed order so shards are reproducible.'''
+    ordered = sorted(test_combinations, key=repr)
+    return [set(ordered[index::count]) for index in range(count)]
+
+def run_stack(stack, fuzz_test):
+    '''
+    Fly a shard on a real vehicle stack and return its result records.
+    Runs in its own process: the stack's environment and working directory are process-wide.
+    '''
+    os.environ.update(stack.environment())
+    workdir = stack.working_directory()
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    # the stack's Fuzz_Testor appends to the result store in workdir; only this run's rows are returned
+    store = Result_Store(RESULT_STORE)
+    last_id = store.last_id()
+
+    # imported here so the campaign runner itself (and stand-in campaigns) do not need ROS or MQTT
+    from FuzzTestor import Fuzz_Testor
+    fuzz_testor = Fuzz_Testor(stack=stack)
+    fuzz_testor.run_test(fuzz_test)
+    fuzz_testor.test_complete.wait()
+    fuzz_testor.trigger_shutdown()
+    try:
+        return store.records(after_id=last_id)
+    finally:
+        store.close()
+
+class Stand_In_Vehicle:
+    '''
+    Local stand-in for a vehicle stack, used to exercise campaigns without simulators.
+
+    Every combination of the shard "flies" for flight_time seconds and is recorded with
+    the fields of fuzz_common.make_record. If sample_log is set each record is analyzed
+    from that .ulg against blueprint_name, so the log analysis path runs for real.
+    '''
+
+    def __init__(self, flight_time=1.0, sample_log=None, blueprint_name=None):
+        self.flight_time = flight_time
+        self.sample_log = sample_log
+        self.blueprint_name = blueprint_name
+
+    def __call__(self, stack, fuzz_test):
+        records = []
+        for combination in sorted(fuzz_test.test_combinations, key=repr):
+            time.sleep(self.flight_time)
+            record = {
+                "filename": None,
+                "mission": str(combination),
+                "max_deviation": None,
+                "max_altitude": None,
+                "duration": self.flight_time,
+                "final_landing_state": True,
+                "freefall_occurred": False,
+                "mission_complete": True
+            }
+            if self.sample_log is not None:
+                blueprint_name = self.blueprint_name or get_max_deviation.find_blueprint()
+                max_difference, max_altitude, duration, end_land_status, freefall_occurred = get_max_deviation.analyze_log(self.sample_log, blueprint_name)
+                record.update({
+                    "filename": self.sample_log,
+                    "max_deviation": float(max_difference),
+                    "max_altitude": max_altitude,
+                    "duration": duration,
+                    "final_landing_state": end_land_status,
+                    "freefall_occurred": freefall_occurred
+                })
+            records.append(record)
+        return records
+
+class Campaign_Runner:
+    '''
+    Shards a Fuzz_Test across vehicle stacks and merges the results.
+
+    Args:
+        stacks (List[Vehicle_Stack]): The stacks to fly on.
+        worker (Callable[[Vehicle_Stack, Fuzz_Test], List[dict]]): Flies one shard on one stack.
+            Defaults to run_stack; pass a Stand_In_Vehicle to run without simulators.
+        output (str): JSONL file the merged records are appended to. None disables it.
+    '''
+
+    def __init__(self, stacks, worker=run_stack, output=CAMPAIGN_RESULTS_FILE):
+        if len({stack.uav_id for stack in stacks}) != len(stacks):
+            raise ValueError('[campaign] every vehicle stack needs its own uav_id')
+        self.stacks = stacks
+        self.worker = worker
+        self.output = output
+
+    def shard(self, fuzz_test):
+        '''One Fuzz_Test per stack with a disjoint share of the combinations (stacks without work are dropped).'''
+        shards = []
+        for stack, combinations in zip(self.stacks, shard_combinations(fuzz_test.test_combinations, len(self.stacks))):
+            if not combinations:
+                continue
+            shard = copy.copy(fuzz_test)
+            shard.test_combinations = combinations
+            shards.append((stack, shard))
+        return shards
+
+    def run(self, fuzz_test):
+        '''Fly every shard in parallel and return the merged records, each tagged with its uav_id.'''
+        shards = self.shard(fuzz_test)
+        start_time = time.time()
+        results = []
+        # spawn: every stack gets a fresh interpreter (own rospy node, MQTT client and environment)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max(len(shards), 1), mp_context=context) as executor:
+            futures = {executor.submit(self.worker, stack, shard): (stack, shard) for stack, shard in shards}
+            for future in as_completed(futures):
+                stack, shard = futures[future]
+                try:
+                    records = future.result()
+                except Exception as e:
+                    print(f'[campaign] stack {stack.uav_id} failed after its shard of {len(shard.test_combinations)} tests: {e}')
+                    continue
+                for record in records:
+                    record["uav_id"] = stack.uav_id
+                self._write(records)
+                results.extend(records)
+                print(f'[campaign] stack {stack.uav_id} finished {len(records)} tests')
+        elapsed = time.time() - start_time
+        print(f'[campaign] {len(results)} tests on {len(shards)} stacks in {elapsed:.1f}s')
+        return results
+
+    def _write(self, records):
+        if self.output is None:
+            return
+        with open(self.output, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Shard a fuzz test across several vehicle stacks.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--stacks', help='JSON list of Vehicle_Stack fields.')
+    source.add_argument('--stand-in', type=int, metavar='N', help='Use N local stand-in vehicles instead of real stacks.')
+    parser.add_argument('--flight-time', type=float, default=1.0, help='Seconds per stand-in flight.')
+    parser.add_argument('--sample-log', default=None, help='.ulg the stand-in analyzes for every flight.')
+    parser.add_argument('--output', default=CAMPAIGN_RESULTS_FILE)
+    parser.add_argument('--drone-id', default="Polkadot")
+    parser.add_argument('--modes', nargs='*', default=[])
+    parser.add_argument('--states', nargs='*', default=[])
+    parser.add_argument('--geofence', nargs='*', type=int, default=[])
+    parser.add_argument('--throttle', nargs='*', type=int, default=[])
+    args = parser.parse_args()
+
+    from entities import Fuzz_Test
+    fuzz_test = Fuzz_Test(drone_id=args.drone_id, modes=args.modes, states=args.states,
+                          geofence=args.geofence, throttle=args.throttle)
+    if args.stacks:
+        runner = Campaign_Runner(load_stacks(args.stacks), output=args.output)
+    else:
+        stacks = [Vehicle_Stack(uav_id=f"Stand_In_{index}") for index in range(args.stand_in)]
+        runner = Campaign_Runner(stacks, Stand_In_Vehicle(args.flight_time, args.sample_log), output=args.output)
+    runner.run(fuzz_test)
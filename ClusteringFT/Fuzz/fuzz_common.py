@@ -0,0 +1,136 @@
+import os
+import shutil
+import time
+
+from log_analyzer import get_max_deviation
+
+'''
+Mission logic shared by the threaded Fuzz_Testor and the asyncio Async_Fuzz_Testor
+(which cannot import FuzzTestor, since that imports ROS at module level):
+which test to inject next, how it is sent, when a flight may take another injection,
+how a mission log is analyzed, and the layout of the result record.
+'''
+
+#MQTT MISSION SENDER PUB TOPIC
+MQTT_MISSION = "drone/{}/mission-spec"
+#LOG ANALYZER directory that contender logs are copied into
+CONTENDER_LOG_DIR = "/catkin_ws/src/fuzz_test_service/Fuzz/log_analyzer/contender_logs"
+#seconds to wait for PX4 to close a finished mission's log (shared log directory only)
+LOG_CLOSE_TIMEOUT = 10
+#several injections per flight: seconds the flight must run on after an injection before the next one
+RECOVERY_WINDOW = 10
+
+def select_fuzz_test(fuzz_test, current_state, executed_tests, tested_modes_by_state, mode_throttle_combos):
+    '''
+    Next test to inject in current_state, or None if there is none left there.
+    Geofence tests ignore the state; state tests pick a mode/throttle not yet tested in this state
+    (only combinations of this test: a campaign shard holds a subset of the state combinations).
+    '''
+    if "geo" in fuzz_test.fuzz_type:
+        available_tests = set(fuzz_test.test_combinations) - executed_tests
+    else:
+        if current_state not in fuzz_test.states:
+            return None
+        tested = tested_modes_by_state.get(current_state, set())
+        available_tests = {test for test in mode_throttle_combos - tested
+                           if test + (current_state,) in fuzz_test.test_combinations}
+    if not available_tests:
+        return None
+    return available_tests.pop()
+
+def execute_fuzz_test(fuzz_test, ros_interface, fuzz_tuple):
+    command_dict = fuzz_test.populate_command(fuzz_tuple)
+    if "geo" in fuzz_test.fuzz_type:
+        ros_interface.reset_fuzz_done_flag()
+        ros_interface.reset_geo_flag()
+        ros_interface.send_geo_commands(command_dict)
+    else:
+        ros_interface.send_command(command_dict)
+
+def mark_executed(fuzz_test, fuzz_tuple, current_state, executed_tests, tested_modes_by_state):
+    '''Record an injected test and return its entry in executed_tests (state tests include the state).'''
+    if "state" in fuzz_test.fuzz_type:
+        tested_modes_by_state.setdefault(current_state, set()).add(fuzz_tuple)
+        fuzz_tuple = fuzz_tuple + (current_state,)
+    executed_tests.add(fuzz_tuple)
+    return fuzz_tuple
+
+def recovered(fuzz_type, flight_injections, injections_per_flight, curr_state, failed=False, recovery_window=RECOVERY_WINDOW):
+    '''
+    Isolation policy for several injections per flight (flight_injections are (test, state, time)).
+    The next injection is allowed once
+    - the flight has run recovery_window seconds past the last injection,
+    - the state machine has moved on from the state that injection was made in, and
+    - the flight has not been flagged as failed (by the deviation monitor, with early_abort).
+    '''
+    if "state" not in fuzz_type or not flight_injections or len(flight_injections) >= injections_per_flight:
+        return False
+    _, injected_state, injected_at = flight_injections[-1]
+    return time.time() - injected_at >= recovery_window and curr_state != injected_state and not failed
+
+def injection_offsets(flight_injections, flight_start):
+    '''(test, seconds since the flight start) of each (test, state, time) injection of a flight.'''
+    flight_start = flight_start if flight_start is not None else time.time()
+    return [(test, max(injected_at - flight_start, 0)) for test, _, injected_at in flight_injections]
+
+def analyze_contender(contender, segments=None, in_place=False):
+    '''
+    Analyze a mission log, by default as a whole, or one result per (start, end) segment in seconds
+    since the flight start. Returns a list of ([max_deviation, max_altitude, duration,
+    final_landing_state, freefall_occurred], log metadata, feature row) tuples.
+    A copied log is deleted afterwards; with in_place (a log in the shared log directory) it is kept.
+    '''
+    count = 1 if segments is None else len(segments)
+    if contender is None:
+        return [([None] * 5, {}, {}) for _ in range(count)]
+    try:
+        if segments is not None:
+            return get_max_deviation.analyze_segments(contender, get_max_deviation.find_blueprint(), segments)
+        log_metadata = {}
+        # wide row of every registered metric, computed in the same pass over the log
+        features = {}
+        analysis = get_max_deviation.analyze_log(contender, get_max_deviation.find_blueprint(), metadata=log_metadata, features=features)
+        return [(analysis, log_metadata, features)]
+    finally:
+        if not in_place:
+            shutil.rmtree(os.path.dirname(contender), ignore_errors=True)
+
+def make_record(ulg_file_path, test, mission_status, analysis, log_metadata, features, extra=None):
+    max_difference, max_altitude, duration, end_land_status, freefall_occurred = analysis
+    json_object = {
+        "filename": ulg_file_path,
+        "mission": str(test),
+        "max_deviation": max_difference,
+        "max_altitude": max_altitude,
+        "duration": duration,
+        "final_landing_state": end_land_status,
+        "freefall_occurred": freefall_occurred,
+        "mission_complete": mission_status,
+        "log_metadata": log_metadata,
+        "features": features
+    }
+    if extra:
+        json_object.update(extra)
+    return json_object
+
+def mission_records(ulg_file_path, recent_test, injections, mission_status, contender, in_place=False):
+    '''
+    Analyze a finished mission and return its result records.
+    A flight with several injections gets one record per injection, with the analysis of its own
+    log segment, from the injection to the next one (the last runs to the end of the log).
+    Only the last injection gets the outcome of the flight as mission_complete; the earlier ones
+    have none and are recorded as recovered instead (the next one was only made after the flight
+    recovered, see recovered).
+    '''
+    if len(injections) <= 1:
+        analysis, log_metadata, features = analyze_contender(contender, in_place=in_place)[0]
+        return [make_record(ulg_file_path, recent_test, mission_status, analysis, log_metadata, features)]
+    offsets = [offset for _, offset in injections]
+    segments = list(zip(offsets, offsets[1:] + [None]))
+    results = analyze_contender(contender, segments, in_place)
+    records = []
+    for index, ((test, _), segment, (analysis, log_metadata, features)) in enumerate(zip(injections, segments, results)):
+        last = index == len(injections) - 1
+        records.append(make_record(ulg_file_path, test, mission_status if last else None, analysis, log_metadata, features,
+                                   {"injection": index, "segment": list(segment), "recovered": None if last else True}))
+    return records
@@ -0,0 +1,118 @@
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .blueprint_cache import get_blueprint
+from .get_max_deviation import DEVIATION_MODE, ALIGNMENT_STEP, analyze_log, find_blueprint
+from .metrics import extract_features
+
+"""
+Batch analysis of a directory (or glob) of contender logs.
+
+Every .ulg is analyzed with analyze_log() in a process pool and one JSON line is
+streamed per log, with the same fields fuzz_common.make_record records.
+With --features each line is instead the flat feature row of every registered metric
+extractor (see metrics.py), which pandas.read_json(..., lines=True) loads as a table.
+Nothing is copied or deleted, so a whole campaign can be re-analysed without re-flying.
+Run from the Fuzz directory:
+	python -m log_analyzer.batch /path/to/logs --output results.jsonl
+"""
+
+def collect_logs(source):
+	'''
+	Resolve a directory (searched recursively), a glob pattern or a single file into
+	a sorted list of (log path, name to record) pairs.
+	'''
+	if os.path.isdir(source):
+		paths = glob.glob(os.path.join(source, "**", "*.ulg"), recursive=True)
+		return [(log, os.path.relpath(log, source)) for log in sorted(paths)]
+	return [(log, log) for log in sorted(glob.glob(source, recursive=True))]
+
+def _analyze(log, filename, blueprint_name, mode, features=False):
+	if features:
+		row = {"filename": filename}
+		try:
+			row.update(extract_features(log, blueprint_name, mode))
+		except Exception as e:
+			row["error"] = "{}: {}".format(type(e).__name__, e)
+		return row
+	record = {
+		"filename": filename,
+		"mission": None,
+		"max_deviation": None,
+		"max_altitude": None,
+		"duration": None,
+		"final_landing_state": None,
+		"freefall_occurred": None,
+		"mission_complete": None
+	}
+	metadata = {}
+	try:
+		max_difference, max_altitude, duration, end_land_status, freefall_occurred = analyze_log(log, blueprint_name, mode, metadata)
+	except Exception as e:
+		record["error"] = "{}: {}".format(type(e).__name__, e)
+		return record
+	record.update({
+		"max_deviation": float(max_difference),
+		"max_altitude": max_altitude,
+		"duration": duration,
+		"final_landing_state": end_land_status,
+		"freefall_occurred": freefall_occurred,
+		"log_metadata": metadata
+	})
+	return record
+
+def analyze_logs(source, output, blueprint_name=None, workers=None, mode=DEVIATION_MODE, features=False):
+	'''
+	Analyze every log matched by source across a process pool.
+
+	Args:
+		source (str): Directory, glob pattern or single .ulg file.
+		output (file): Text stream that receives one JSON record per line, as logs finish.
+		blueprint_name (str): Blueprint .ulg (or CSV export). Defaults to the analyzer's blueprint folder.
+		workers (int): Number of processes. Defaults to the number of cores.
+		mode (str): Deviation mode passed to analyze_log ("axis", "spatial" or "aligned").
+		features (bool): Write the full metric feature row per log instead of the make_record fields.
+
+	Returns:
+		int: Number of logs analyzed.
+	'''
+	logs = collect_logs(source)
+	if not logs:
+		print('[log_analyzer] no .ulg files found for', source, file=sys.stderr)
+		return 0
+	if blueprint_name is None:
+		blueprint_name = find_blueprint()
+	# populate the on-disk blueprint cache once, so the workers only memory-map it
+	blueprint = get_blueprint(blueprint_name)
+	if mode == "spatial" or features:
+		blueprint.tree()
+	elif mode == "aligned":
+		blueprint.aligned(ALIGNMENT_STEP)
+
+	workers = workers or os.cpu_count() or 1
+	with ProcessPoolExecutor(max_workers=min(workers, len(logs))) as executor:
+		futures = [executor.submit(_analyze, log, filename, blueprint_name, mode, features) for log, filename in logs]
+		for future in as_completed(futures):
+			output.write(json.dumps(future.result()) + "\n")
+			output.flush()
+	return len(logs)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Analyze a directory or glob of contender .ulg logs in parallel.")
+	parser.add_argument('source', help='Directory (searched recursively), glob pattern or .ulg file.')
+	parser.add_argument('--blueprint', default=None, help='Blueprint .ulg. Defaults to the analyzer blueprint folder.')
+	parser.add_argument('--output', default='-', help='JSONL output file, "-" for stdout.')
+	parser.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores).')
+	parser.add_argument('--mode', choices=['axis', 'spatial', 'aligned'], default=DEVIATION_MODE)
+	parser.add_argument('--features', action='store_true', help='Write every metric extractor feature instead of the make_record fields.')
+	args = parser.parse_args()
+
+	if args.output == '-':
+		count = analyze_logs(args.source, sys.stdout, args.blueprint, args.workers, args.mode, args.features)
+	else:
+		with open(args.output, 'a') as f:
+			count = analyze_logs(args.source, f, args.blueprint, args.workers, args.mode, args.features)
+	print('[log_analyzer] analyzed {} logs'.format(count), file=sys.stderr)
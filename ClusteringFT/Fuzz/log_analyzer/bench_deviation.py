@@ -0,0 +1,57 @@
+import argparse
+import time
+import numpy as np
+from .get_max_deviation import get_closest_timestamp, get_closest_timestamps
+
+"""
+Micro-benchmark for the deviation kernel used by log_parser().
+
+Compares the original per-sample get_closest_timestamp loop with the vectorized
+get_closest_timestamps kernel on synthetic trajectories.
+Run from the Fuzz directory:
+	python -m log_analyzer.bench_deviation --sizes 10000 100000 1000000
+The loop is O(N*M), so for large sizes it is timed on a subset of the blueprint
+samples and extrapolated (marked with "~").
+"""
+
+def synthetic_trajectory(size, seed):
+	rng = np.random.default_rng(seed)
+	t = np.linspace(0, 80, size)
+	# smooth sweep with a little sensor noise, rounded so repeated values (ties) occur
+	x = 10 * np.sin(t / 8) + rng.normal(0, 0.05, size)
+	timestamps = (t * 1e6).astype(np.uint64)
+	return np.round(x, 3), timestamps
+
+def time_loop(values, arr, timestamps, budget):
+	subset = values[:budget]
+	start = time.perf_counter()
+	results = [get_closest_timestamp(value, arr, timestamps) for value in subset]
+	elapsed = time.perf_counter() - start
+	return elapsed * len(values) / len(subset), results
+
+def time_kernel(values, arr, timestamps):
+	start = time.perf_counter()
+	results = get_closest_timestamps(values, arr, timestamps)
+	return time.perf_counter() - start, results
+
+def run(sizes, loop_budget):
+	print("{:>10} {:>14} {:>14} {:>10}  {}".format("points", "loop (s)", "kernel (s)", "speedup", "match"))
+	for size in sizes:
+		blueprint, _ = synthetic_trajectory(size, seed=1)
+		contender, timestamps = synthetic_trajectory(size, seed=2)
+		budget = min(size, loop_budget)
+		loop_time, loop_results = time_loop(blueprint, contender, timestamps, budget)
+		kernel_time, (differences, closest) = time_kernel(blueprint, contender, timestamps)
+		match = all(
+			difference == differences[i] and timestamp == closest[i]
+			for i, (difference, timestamp) in enumerate(loop_results)
+		)
+		loop_label = ("~" if budget < size else "") + "{:.3f}".format(loop_time)
+		print("{:>10} {:>14} {:>14.4f} {:>9.0f}x  {}".format(size, loop_label, kernel_time, loop_time / kernel_time, match))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark the get_max_deviation kernel.")
+	parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+	parser.add_argument('--loop-budget', type=int, default=2000, help='Blueprint samples timed with the original loop before extrapolating.')
+	args = parser.parse_args()
+	run(args.sizes, args.loop_budget)
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from .ulog_reader import ULog_Reader
+
+"""
+Persistent cache of decoded blueprint data.
+
+The blueprint is decoded once and stored as plain .npy files in
+blueprint/cache/<sha256 of the blueprint file>/, which are memory-mapped on later
+analyses. Derived indexes (the KD-tree used by the spatial deviation mode and the
+resampled grids used by the aligned mode) are stored next to them, so the
+per-mission cost only depends on the contender log.
+"""
+
+CACHE_DIR_NAME = "cache"
+POSITIONS_FILE = "positions.npy"
+TIMESTAMPS_FILE = "timestamps.npy"
+KDTREE_FILE = "kdtree.pkl"
+ALIGNED_FILE = "aligned_{}ms.npy"
+
+#altitude (m) that marks takeoff; logs are aligned on it so time spent on the ground does not matter
+TAKEOFF_ALTITUDE = 0.5
+
+# (blueprint file, mtime, size) -> content hash, so a blueprint is hashed once per process
+_digests = {}
+# content hash -> Blueprint_Cache
+_entries = {}
+
+def hash_file(file_path, chunk_size=1 << 20):
+	digest = hashlib.sha256()
+	with open(file_path, 'rb') as f:
+		for chunk in iter(lambda: f.read(chunk_size), b''):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+def decode_blueprint(blueprint_name):
+	"""Decode the blueprint local position into an (N, 3) float64 array of x, y, z and its timestamps."""
+	if blueprint_name.endswith(".ulg"):
+		local_position = ULog_Reader(blueprint_name, topics=["vehicle_local_position"]).data("vehicle_local_position")
+		positions = np.column_stack([local_position[axis].astype(np.float64) for axis in ('x', 'y', 'z')])
+		return positions, local_position['timestamp'].astype(np.uint64)
+	blueprint_data = pd.read_csv(blueprint_name, usecols=['timestamp', 'x', 'y', 'z'])
+	positions = blueprint_data[['x', 'y', 'z']].to_numpy(dtype=np.float64)
+	return positions, blueprint_data['timestamp'].to_numpy(dtype=np.uint64)
+
+def alignment_origin(timestamps, z):
+	'''Timestamp (us) that both logs are aligned on: the first sample above TAKEOFF_ALTITUDE, else the first sample.'''
+	airborne = np.flatnonzero(-np.asarray(z) > TAKEOFF_ALTITUDE)
+	return int(timestamps[airborne[0]] if len(airborne) else timestamps[0])
+
+def resample(timestamps, positions, origin, step, count):
+	'''
+	Linearly interpolate (N, 3) positions onto count grid points spaced step seconds
+	apart from origin. Points outside the log hold its first/last position.
+	'''
+	times = (np.asarray(timestamps, dtype=np.int64) - origin) / 1e6
+	grid = np.arange(count) * step
+	return np.column_stack([np.interp(grid, times, positions[:, axis]) for axis in range(3)])
+
+def finite_samples(timestamps, positions):
+	finite = np.isfinite(positions).all(axis=1)
+	return np.asarray(timestamps)[finite], np.asarray(positions)[finite]
+
+class Blueprint_Cache:
+	'''
+	Decoded blueprint arrays and derived indexes stored under one content hash.
+
+	Attributes:
+		positions (np.ndarray): Memory-mapped (N, 3) array of blueprint x, y, z.
+		timestamps (np.ndarray): Memory-mapped blueprint timestamps in microseconds.
+	'''
+
+	def __init__(self, cache_dir):
+		self.cache_dir = cache_dir
+		self.positions = np.load(os.path.join(cache_dir, POSITIONS_FILE), mmap_mode='r')
+		self.timestamps = np.load(os.path.join(cache_dir, TIMESTAMPS_FILE), mmap_mode='r')
+		self._tree = None
+
+	def axes(self):
+		return self.positions[:, 0], self.positions[:, 1], self.positions[:, 2]
+
+	def tree(self):
+		'''KD-tree over the finite blueprint positions, built on first use and then persisted.'''
+		if self._tree is not None:
+			return self._tree
+		tree_path = os.path.join(self.cache_dir, KDTREE_FILE)
+		if os.path.exists(tree_path):
+			with open(tree_path, 'rb') as f:
+				self._tree = pickle.load(f)
+			return self._tree
+		positions = np.asarray(self.positions)
+		self._tree = cKDTree(positions[np.isfinite(positions).all(axis=1)])
+		_write_atomic(tree_path, lambda f: pickle.dump(self._tree, f, protocol=pickle.HIGHEST_PROTOCOL))
+		return self._tree
+
+	def aligned(self, step):
+		'''
+		Blueprint positions resampled onto a grid of step seconds starting at takeoff,
+		as a memory-mapped (K, 3) array. Built on first use and then persisted.
+		'''
+		aligned_path = os.path.join(self.cache_dir, ALIGNED_FILE.format(int(round(step * 1000))))
+		if not os.path.exists(aligned_path):
+			timestamps, positions = finite_samples(self.timestamps, self.positions)
+			origin = alignment_origin(timestamps, positions[:, 2])
+			count = int((int(timestamps[-1]) - origin) / 1e6 / step) + 1
+			grid = resample(timestamps, positions, origin, step, count)
+			_write_atomic(aligned_path, lambda f: np.save(f, grid))
+		return np.load(aligned_path, mmap_mode='r')
+
+def _write_atomic(file_path, write):
+	directory = os.path.dirname(file_path)
+	fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			write(f)
+		os.replace(tmp_path, file_path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+def _blueprint_digest(blueprint_name):
+	stat = os.stat(blueprint_name)
+	key = (os.path.abspath(blueprint_name), stat.st_mtime_ns, stat.st_size)
+	digest = _digests.get(key)
+	if digest is None:
+		digest = hash_file(blueprint_name)
+		_digests[key] = digest
+	return digest
+
+def get_blueprint(blueprint_name, cache_root=None):
+	'''
+	Return the Blueprint_Cache for a blueprint file, decoding it only if no artifact
+	exists yet for its content hash.
+	'''
+	digest = _blueprint_digest(blueprint_name)
+	entry = _entries.get(digest)
+	if entry is not None:
+		return entry
+
+	if cache_root is None:
+		cache_root = os.path.join(os.path.dirname(os.path.abspath(blueprint_name)), CACHE_DIR_NAME)
+	cache_dir = os.path.join(cache_root, digest)
+	if not os.path.isdir(cache_dir):
+		os.makedirs(cache_root, exist_ok=True)
+		positions, timestamps = decode_blueprint(blueprint_name)
+		# build in a private directory and rename it into place so readers never see a partial entry
+		build_dir = tempfile.mkdtemp(dir=cache_root, prefix=digest + '.')
+		try:
+			np.save(os.path.join(build_dir, POSITIONS_FILE), positions)
+			np.save(os.path.join(build_dir, TIMESTAMPS_FILE), timestamps)
+			os.rename(build_dir, cache_dir)
+		except OSError:
+			# another analysis published the same entry first
+			if not os.path.isdir(cache_dir):
+				raise
+		finally:
+			if os.path.isdir(build_dir):
+				shutil.rmtree(build_dir)
+		print('[blueprint_cache] cached blueprint', blueprint_name, 'as', digest)
+
+	entry = Blueprint_Cache(cache_dir)
+	_entries[digest] = entry
+	return entry
@@ -0,0 +1,125 @@
+import numpy as np
+from .blueprint_cache import get_blueprint, alignment_origin, resample, finite_samples
+
+"""
+Deviation kernels shared by log_parser() and the metric extractors.
+Every kernel compares a whole contender trajectory against the blueprint in vectorized NumPy.
+"""
+
+# "axis" compares x, y and z separately against the closest contender value,
+# "spatial" uses the 3D distance of every contender sample to the blueprint path,
+# "aligned" compares both logs position by position on a common clock that starts at takeoff
+DEVIATION_MODE = "axis"
+#grid step (s) of the aligned mode
+ALIGNMENT_STEP = 0.1
+
+def load_blueprint(blueprint_name):
+	"""Return the blueprint x, y, z positions as (memory-mapped) NumPy arrays."""
+	return get_blueprint(blueprint_name).axes()
+
+def get_closest_timestamp(value, arr, timestamps):
+	timestampIndex = np.abs(arr - value).argmin()
+	difference = np.abs(value - arr[timestampIndex])
+	return difference, timestamps[timestampIndex]
+
+def get_closest_timestamps(values, arr, timestamps):
+	"""
+	Vectorized get_closest_timestamp for every entry of values at once.
+	arr is sorted once and each value is located with a binary search, so the cost is
+	O((N+M) log M) instead of O(N*M). Ties resolve to the earliest sample, like argmin.
+	"""
+	valid = ~np.isnan(arr)
+	if not valid.all():
+		arr, timestamps = arr[valid], timestamps[valid]
+	if len(arr) == 0:
+		return np.full(len(values), np.nan), np.zeros(len(values), dtype=timestamps.dtype)
+	order = np.argsort(arr, kind='stable')
+	sorted_arr = arr[order]
+	last = len(sorted_arr) - 1
+	right = np.searchsorted(sorted_arr, values, side='left')
+	left = np.clip(right - 1, 0, last)
+	right = np.clip(right, 0, last)
+	# step back to the first occurrence of the left value so duplicates keep the earliest sample
+	left = np.searchsorted(sorted_arr, sorted_arr[left], side='left')
+	left_difference = np.abs(values - sorted_arr[left])
+	right_difference = np.abs(values - sorted_arr[right])
+	use_right = (right_difference < left_difference) | ((right_difference == left_difference) & (order[right] < order[left]))
+	closest = order[np.where(use_right, right, left)]
+	return np.where(use_right, right_difference, left_difference), timestamps[closest]
+
+def get_axis_deviation(blueprint_axes, contender_axes, timestamps, threshold):
+	"""
+	Largest per-axis distance between a blueprint sample and the closest contender value.
+	Returns max_difference, max_timestamp, max_axis and violating_axes.
+	"""
+	max_difference = 0
+	max_timestamp = 0
+	max_axis = ""
+	violating_axes = []
+	for axis, values, arr in zip(("x", "y", "z"), blueprint_axes, contender_axes):
+		if len(values) == 0 or len(arr) == 0:
+			continue
+		differences, closest_timestamps = get_closest_timestamps(values, arr, timestamps)
+		differences = np.where(np.isnan(differences), -np.inf, differences)
+		index = differences.argmax()
+		if differences[index] > max_difference:
+			max_difference, max_timestamp = differences[index], closest_timestamps[index]
+			max_axis = axis
+		if (differences > threshold).any():
+			violating_axes.append(axis)
+	return max_difference, max_timestamp, max_axis, violating_axes
+
+def get_spatial_distances(tree, contender_axes, timestamps):
+	"""
+	Euclidean distance from every finite contender sample to the nearest blueprint sample,
+	answered in one vectorized KD-tree query. Returns the distances and their timestamps.
+	"""
+	points = np.column_stack(contender_axes)
+	finite = np.isfinite(points).all(axis=1)
+	points, timestamps = points[finite], timestamps[finite]
+	if len(points) == 0:
+		return np.zeros(0), timestamps
+	distances, _ = tree.query(points)
+	return distances, timestamps
+
+def get_spatial_deviation(tree, contender_axes, timestamps):
+	"""
+	Largest distance from the contender to the blueprint path.
+	Returns max_difference, max_timestamp and rms_difference.
+	"""
+	distances, timestamps = get_spatial_distances(tree, contender_axes, timestamps)
+	return summarize_distances(distances, timestamps)
+
+def get_aligned_distances(blueprint, contender_axes, timestamps, step=ALIGNMENT_STEP):
+	"""
+	Resample the contender onto the blueprint's cached time grid and compare both
+	positions at every step in one vectorized pass.
+	If the contender flies longer than the blueprint, the blueprint holds its final position.
+	Returns the distance at every grid step and the contender timestamp of each step.
+	"""
+	timestamps, points = finite_samples(timestamps, np.column_stack(contender_axes))
+	if len(points) == 0:
+		return np.zeros(0), timestamps
+	blueprint_grid = blueprint.aligned(step)
+	origin = alignment_origin(timestamps, points[:, 2])
+	count = max(len(blueprint_grid), int((int(timestamps[-1]) - origin) / 1e6 / step) + 1)
+	contender_grid = resample(timestamps, points, origin, step, count)
+	if count > len(blueprint_grid):
+		padding = np.repeat(blueprint_grid[-1:], count - len(blueprint_grid), axis=0)
+		blueprint_grid = np.concatenate((blueprint_grid, padding))
+	distances = np.linalg.norm(contender_grid - blueprint_grid, axis=1)
+	return distances, origin + np.round(np.arange(count) * step * 1e6).astype(np.int64)
+
+def get_aligned_deviation(blueprint, contender_axes, timestamps, step=ALIGNMENT_STEP):
+	"""
+	Largest distance between the contender and the blueprint at the same time since takeoff.
+	Returns max_difference, max_timestamp and rms_difference.
+	"""
+	distances, timestamps = get_aligned_distances(blueprint, contender_axes, timestamps, step)
+	return summarize_distances(distances, timestamps)
+
+def summarize_distances(distances, timestamps):
+	if len(distances) == 0:
+		return 0, 0, 0
+	index = distances.argmax()
+	return distances[index], int(timestamps[index]), float(np.sqrt(np.mean(distances ** 2)))
@@ -1,134 +1,104 @@
-import pandas as pd
-import numpy as np
 import glob
 import os
-import csv
+from .metrics import EXTRACTORS, CORE_EXTRACTORS, extract_features, extract_segment_features
+# ALIGNMENT_STEP (batch.py) and the closest-timestamp kernels (bench_deviation.py) are re-exported from here
+from .deviation import DEVIATION_MODE, ALIGNMENT_STEP, get_closest_timestamp, get_closest_timestamps
 
 """
 Directories should be set up as follows:
 >path_to_analysis_directory/
 	-this_script
+	-ulog_reader.py
+	-blueprint_cache.py
+	-deviation.py
+	-metrics.py
 	>blueprint/
 		-blueprint.ulg
+		>cache/ (decoded blueprint, created on first use)
 	>contender_logs/
 		-contender1.ulg
 		-contender2.ulg
 		-...
 
-If this file is not already in the analysis directory:
-set this path to your analysis directory -- 
+Every function takes the analysis directory (or explicit file paths) as an argument,
+so several analyses can run at the same time in threads or processes.
+ANALYSIS_DIR is only the default analysis directory --
 the one that contains the "blueprint" and "contender_logs" folders
 for example: 
-"/home/droneresponse/Desktop/log_storage/" (you need the final "/" at the end)
+"/home/droneresponse/Desktop/log_storage/"
 """
-# def log_parser():
-	# path = "/home/droneresponse/Desktop/log_storage/"
-path = "/catkin_ws/src/fuzz_test_service/Fuzz/log_analyzer/"
-
-def get_names():
-	blueprint_name = glob.glob(path + "blueprint" + "/*.ulg")[0]
-	if len(glob.glob(path + "blueprint" + "/*.csv")) == 0:
-		os.system("ulog2csv " + blueprint_name)
-	blueprint_name = (blueprint_name.rsplit("/", 1)[1]).split(".")[0] + "_vehicle_local_position_0.csv"
-	contender_list = glob.glob(path + "contender_logs" + "/*.ulg")
+ANALYSIS_DIR = "/catkin_ws/src/fuzz_test_service/Fuzz/log_analyzer/"
+
+# analysis directory -> blueprint file found there
+_blueprint_names = {}
+
+def find_blueprint(analysis_dir=ANALYSIS_DIR):
+	blueprint_name = _blueprint_names.get(analysis_dir)
+	if blueprint_name is None or not os.path.exists(blueprint_name):
+		blueprint_dir = os.path.join(analysis_dir, "blueprint")
+		# prefer the raw blueprint log; the CSV export is only kept for older setups
+		blueprint_logs = sorted(glob.glob(os.path.join(blueprint_dir, "*.ulg")))
+		if blueprint_logs:
+			blueprint_name = blueprint_logs[0]
+		else:
+			blueprint_name = sorted(glob.glob(os.path.join(blueprint_dir, "*_vehicle_local_position_0.csv")))[0]
+		_blueprint_names[analysis_dir] = blueprint_name
+	return blueprint_name
+
+def get_names(analysis_dir=ANALYSIS_DIR):
+	blueprint_name = find_blueprint(analysis_dir)
+	contender_list = glob.glob(os.path.join(analysis_dir, "contender_logs", "*.ulg"))
 	print(contender_list)
 	return blueprint_name, contender_list[0]
 
-def get_closest_timestamp(value, arr, timestamps):
-	timestampIndex = np.abs(arr - value).argmin()
-	difference = np.abs(value - arr[timestampIndex])
-	return difference, timestamps[timestampIndex]
-
-def log_parser():
-	#set threshold for what to consider a deviation from the intended flight path
+def analyze_log(contender, blueprint_name, mode=DEVIATION_MODE, metadata=None, features=None):
+	"""
+	Analyze a single contender .ulg against the blueprint without touching any files.
+	Returns [max_deviation, max_altitude, duration, final_landing_state, freefall_occurred],
+	with the duration in seconds. If a dict is passed as metadata it is filled with the
+	log header metadata (start/end timestamps, dropout statistics, see ULog_Reader.metadata).
+	If a dict is passed as features, every registered metric extractor runs in the same
+	pass and the dict is filled with the full feature row (see metrics.py).
+	"""
+	row = extract_features(contender, blueprint_name, mode, None if features is not None else CORE_EXTRACTORS)
+	return _summarize(row, metadata, features)
+
+def analyze_segments(contender, blueprint_name, segments, mode=DEVIATION_MODE):
+	"""
+	Analyze several segments of one contender .ulg (decoded once), e.g. one per fault injection.
+	segments are (start, end) in seconds since the flight start, i.e. the arming recorded in the log
+	(end None: to the end of the log).
+	Returns one (analyze_log result, log metadata, feature row) tuple per segment.
+	"""
+	results = []
+	for row in extract_segment_features(contender, segments, blueprint_name, mode):
+		metadata = {}
+		results.append((_summarize(row, metadata, None), metadata, row))
+	return results
+
+def _summarize(row, metadata, features):
+	if metadata is not None:
+		metadata.update({key: row[key] for key in EXTRACTORS["log"].features})
+	if features is not None:
+		features.update(row)
+	return [row["max_deviation"], row["max_altitude"], row["duration"], row["final_landing_state"], row["freefall_occurred"]]
+
+def log_parser(mode=DEVIATION_MODE, analysis_dir=ANALYSIS_DIR, contender=None, metadata=None, features=None):
+	"""
+	Analyze one contender log and delete it afterwards.
+	If contender is None, the log is taken from analysis_dir/contender_logs.
+	"""
+	if contender is None:
+		blueprint_name, contender = get_names(analysis_dir)
+	else:
+		blueprint_name = find_blueprint(analysis_dir)
 	try:
-		os.system("rm -r "+path+"ulog2csv_workspace")
-	except:
-		pass
-	threshold = 1
-
-	blueprint_name, contender = get_names()
-
-	blueprint_data = pd.read_csv(path + "blueprint/" + blueprint_name, usecols=['x', 'y', 'z'])
-
-	x_list = blueprint_data['x'].tolist()
-	y_list = blueprint_data['y'].tolist()
-	z_list = blueprint_data['z'].tolist()
-
-	rows = []
-
-	# headings = ["log_name", "max_deviation", "max_altitude", "duration", "final_landing_state", "freefall_occurred"]
-	os.mkdir(path+"ulog2csv_workspace")
-	os.system("cp " + contender + " " + path + "ulog2csv_workspace")
-	contender_name_base = (contender.rsplit("/", 1)[1])
-	os.system("ulog2csv " + path + "ulog2csv_workspace/" + contender_name_base)
-	os.system("ulog_info " + path + "ulog2csv_workspace/" + contender_name_base + " | grep duration > "+path+"ulog2csv_workspace/duration.txt")
-	contender_name = contender_name_base.split(".")[0] + "_vehicle_local_position_0.csv"
-	contender_data = pd.read_csv(path + "ulog2csv_workspace/" + contender_name, usecols=['x', 'y', 'z', 'timestamp'])
-
-	contender_x = np.array(contender_data['x'].tolist())
-	contender_y = np.array(contender_data['y'].tolist())
-	contender_z = np.array(contender_data['z'].tolist())
-	contender_timestamps = np.array(contender_data['timestamp'].tolist())
-
-	max_difference = 0
-	max_timestamp = 0
-	max_axis = ""
-	violating_axes = []
-	for x in x_list:
-		difference, timestamp = get_closest_timestamp(x, contender_x, contender_timestamps)
-		if difference > max_difference:
-			max_difference, max_timestamp = difference, timestamp
-			max_axis = "x"
-		if difference > threshold and "x" not in violating_axes:
-			violating_axes.append("x")
-			# break
-	for y in y_list:
-		difference, timestamp = get_closest_timestamp(y, contender_y, contender_timestamps)
-		if difference > max_difference:
-			max_difference, max_timestamp = difference, timestamp
-			max_axis = "y"
-		if difference > threshold and "y" not in violating_axes:
-			violating_axes.append("y")
-			# break
-	for z in z_list:
-		difference, timestamp = get_closest_timestamp(z, contender_z, contender_timestamps)
-		if difference > max_difference:
-			max_difference, max_timestamp = difference, timestamp
-			max_axis = "z"
-		if difference > threshold and "z" not in violating_axes:
-			violating_axes.append("z")
-			# break
-
-	contender_name = contender_name_base.split(".")[0] + "_vehicle_land_detected_0.csv"
-	contender_data = pd.read_csv(path + "ulog2csv_workspace/" + contender_name, usecols=['freefall', 'landed'])
-	contender_freefall = np.array(contender_data['freefall'].tolist())
-	contender_landed = np.array(contender_data['landed'].tolist())
-
-	freefall_occurred = 1 in contender_freefall
-	end_land_status = bool(contender_landed[-1])
-
-	max_altitude = abs(min(contender_z))
-
-	duration = ""
-	with open(path + "ulog2csv_workspace/" + "duration.txt") as d:
-		for line in d:
-			duration = line.rsplit(" ", 1)[1].rstrip("\n")
-			break
-
-	row = []
-	# row.append(contender_name_base)
-	row.append(max_difference)
-	row.append(max_altitude)
-	row.append(duration)
-	row.append(end_land_status)
-	row.append(freefall_occurred)
-
-	
-
-	os.system("cd " + path)
-	os.system("rm -r "+path+"ulog2csv_workspace")
-	os.system("rm -r "+path+"contender_logs/*")
-	return row
+		return analyze_log(contender, blueprint_name, mode, metadata, features)
+	finally:
+		# the copy may have failed or the log be gone already; that must not hide the analysis error
+		try:
+			os.remove(contender)
+		except FileNotFoundError:
+			pass
 
 # print(log_parser())
\ No newline at end of file
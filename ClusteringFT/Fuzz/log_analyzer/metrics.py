@@ -0,0 +1,382 @@
+import numpy as np
+from .ulog_reader import ULog_Reader
+from .blueprint_cache import get_blueprint
+from .deviation import DEVIATION_MODE, load_blueprint, get_axis_deviation, get_spatial_distances, get_aligned_distances
+
+"""
+Single-pass metric extraction.
+
+Every metric is computed by a Metric_Extractor that declares the topics it needs and the
+features it produces. extract_features() decodes the union of those topics once and runs
+all extractors on the shared NumPy arrays, returning one flat (wide) feature row:
+	{"max_deviation": ..., "spatial_rms_deviation": ..., "max_climb_rate": ..., "time_in_auto_rtl": ...}
+The row has the same columns for every log (features an extractor cannot compute are None),
+so a list of rows loads straight into a pandas DataFrame for Clustering or an anomaly oracle.
+
+New metrics are added by subclassing Metric_Extractor and decorating it with @register_extractor.
+"""
+
+#name -> extractor, in registration order (the column order of the feature row)
+EXTRACTORS = {}
+
+#extractors behind the fields that fuzz_common.make_record records
+CORE_EXTRACTORS = ("deviation", "altitude", "landing", "log")
+
+#deviation threshold (m) used by the axis mode to report the violating axes
+AXIS_THRESHOLD = 1
+
+#vehicle_status.nav_state values (PX4 NAVIGATION_STATE_*); anything else counts as "other"
+NAV_STATES = {
+	0: "manual",
+	1: "altctl",
+	2: "posctl",
+	3: "auto_mission",
+	4: "auto_loiter",
+	5: "auto_rtl",
+	8: "auto_landengfail",
+	10: "acro",
+	12: "descend",
+	13: "termination",
+	14: "offboard",
+	15: "stab",
+	17: "auto_takeoff",
+	18: "auto_land",
+	19: "auto_follow_target",
+	20: "auto_precland",
+	21: "orbit",
+	22: "auto_vtol_takeoff",
+}
+
+#vehicle_status.arming_state of an armed vehicle
+ARMING_STATE_ARMED = 2
+#topics flight_start() reads, decoded along with the extractors' topics when the log is segmented
+FLIGHT_START_TOPICS = ("vehicle_status", "vehicle_land_detected")
+
+def flight_start(reader):
+	'''
+	Timestamp (us) the flight starts at in the log's own time base: the first armed
+	vehicle_status sample, else the first sample not landed (takeoff), else the log start.
+	'''
+	status = reader.data("vehicle_status")
+	if status is not None and 'arming_state' in status.dtype.names:
+		armed = np.flatnonzero(status['arming_state'] == ARMING_STATE_ARMED)
+		if len(armed):
+			return int(status['timestamp'][armed[0]])
+	land_detected = reader.data("vehicle_land_detected")
+	if land_detected is not None:
+		flying = np.flatnonzero(~land_detected['landed'].astype(bool))
+		if len(flying):
+			return int(land_detected['timestamp'][flying[0]])
+	return reader.start_timestamp
+
+class Flight_Log:
+	'''
+	A decoded contender log plus the analysis settings, shared by all extractors of one pass.
+
+	Attributes:
+		reader (ULog_Reader): The decoded log.
+		blueprint_name (str): Blueprint .ulg (or CSV export) to compare against. May be None.
+		mode (str): Deviation mode ("axis", "spatial" or "aligned").
+		segment (Tuple[float, float]): (start, end) in seconds since the flight start (see flight_start). Extractors then
+			only see the samples in that window; end None means the end of the log. None for the whole log.
+	'''
+
+	def __init__(self, reader, blueprint_name=None, mode=DEVIATION_MODE, segment=None):
+		self.reader = reader
+		self.blueprint_name = blueprint_name
+		self.mode = mode
+		self.segment = segment
+		self.window = None
+		if segment is not None:
+			start, end = segment
+			anchor = flight_start(reader)
+			self.window = (anchor + int(start * 1e6),
+				reader.last_timestamp + 1 if end is None else anchor + int(end * 1e6))
+		self._positions = None
+		self._full_positions = None
+
+	def data(self, topic, multi_id=0):
+		data = self.reader.data(topic, multi_id)
+		if self.window is None:
+			return data
+		return data[self.in_window(data['timestamp'])]
+
+	def in_window(self, timestamps):
+		'''Mask of the timestamps inside the segment (all True for the whole log).'''
+		if self.window is None:
+			return np.ones(len(timestamps), dtype=bool)
+		return (timestamps >= self.window[0]) & (timestamps < self.window[1])
+
+	def start_timestamp(self):
+		return self.reader.start_timestamp if self.window is None else max(self.window[0], self.reader.start_timestamp)
+
+	def end_timestamp(self):
+		return self.reader.last_timestamp if self.window is None else min(self.window[1], self.reader.last_timestamp)
+
+	def positions(self):
+		'''Local position (of the segment) as ((x, y, z) float64 arrays, timestamps), converted once per log.'''
+		if self._positions is None:
+			axes, timestamps = self.full_positions()
+			if self.window is None:
+				self._positions = axes, timestamps
+			else:
+				mask = self.in_window(timestamps)
+				self._positions = tuple(axis[mask] for axis in axes), timestamps[mask]
+		return self._positions
+
+	def full_positions(self):
+		'''Local position of the whole log, for metrics that need the flight before the segment (e.g. the takeoff alignment).'''
+		if self._full_positions is None:
+			local_position = self.reader.data("vehicle_local_position")
+			axes = tuple(local_position[axis].astype(np.float64) for axis in ('x', 'y', 'z'))
+			self._full_positions = axes, local_position['timestamp']
+		return self._full_positions
+
+class Metric_Extractor:
+	'''
+	Base class for a metric plugin.
+
+	Subclasses set name, topics (ULog topics that must be present) and features (the
+	keys extract() returns), and implement extract(log) -> {feature: value}.
+	'''
+	name = None
+	topics = ()
+	features = ()
+	#set when extract() needs the blueprint
+	needs_blueprint = False
+
+	def available(self, log):
+		if self.needs_blueprint and log.blueprint_name is None:
+			return False
+		return all(log.reader.has_topic(topic) and len(log.data(topic)) > 0 for topic in self.topics)
+
+	def extract(self, log):
+		raise NotImplementedError
+
+def register_extractor(cls):
+	'''Class decorator that adds an extractor to the registry used by extract_features().'''
+	if cls.name in EXTRACTORS:
+		raise ValueError('[metrics] duplicate extractor name: {}'.format(cls.name))
+	EXTRACTORS[cls.name] = cls()
+	return cls
+
+def get_extractors(names=None):
+	if names is None:
+		return list(EXTRACTORS.values())
+	return [EXTRACTORS[name] for name in names]
+
+def feature_names(names=None):
+	'''Column names of the feature row produced by the given extractors (all by default).'''
+	return [feature for extractor in get_extractors(names) for feature in extractor.features]
+
+def extract_features(contender, blueprint_name=None, mode=DEVIATION_MODE, extractors=None):
+	'''
+	Decode a contender .ulg once and run every extractor on it.
+
+	Args:
+		contender (str): Path to the .ulg file.
+		blueprint_name (str): Blueprint to compare against; deviation features are None without it.
+		mode (str): Deviation mode used for max_deviation.
+		extractors (Iterable[str]): Names of the extractors to run. Defaults to every registered one.
+
+	Returns:
+		dict: Feature name -> value (plain Python numbers, bools or None).
+	'''
+	return extract_segment_features(contender, [None], blueprint_name, mode, extractors)[0]
+
+def extract_segment_features(contender, segments, blueprint_name=None, mode=DEVIATION_MODE, extractors=None):
+	'''
+	Decode a contender .ulg once and return one feature row per segment (see extract_features).
+	A segment is (start, end) in seconds since the flight start (see flight_start), or None for the whole log.
+	'''
+	selected = get_extractors(extractors)
+	topics = set()
+	for extractor in selected:
+		topics.update(extractor.topics)
+	if any(segment is not None for segment in segments):
+		topics.update(FLIGHT_START_TOPICS)
+	reader = ULog_Reader(contender, topics=topics)
+	return [_extract(Flight_Log(reader, blueprint_name, mode, segment), selected) for segment in segments]
+
+def _extract(log, selected):
+	row = {}
+	for extractor in selected:
+		values = extractor.extract(log) if extractor.available(log) else {}
+		for feature in extractor.features:
+			row[feature] = _plain(values.get(feature))
+	return row
+
+def _plain(value):
+	# NumPy scalars are not JSON serializable
+	if isinstance(value, np.generic):
+		return value.item()
+	return value
+
+def _percentile(distances, q):
+	return float(np.percentile(distances, q)) if len(distances) else 0.0
+
+@register_extractor
+class Deviation_Extractor(Metric_Extractor):
+	'''
+	max_deviation follows the configured mode, like log_parser. The axis mode matches every
+	blueprint sample against the whole flight, so for a log segment max_deviation uses the
+	spatial distances instead.
+	'''
+	name = "deviation"
+	topics = ("vehicle_local_position",)
+	features = ("max_deviation", "max_deviation_timestamp")
+	needs_blueprint = True
+
+	def extract(self, log):
+		axes, timestamps = log.positions()
+		if log.mode == "aligned":
+			# aligned at the takeoff of the whole flight, then cut to the segment
+			distances, distance_timestamps = get_aligned_distances(get_blueprint(log.blueprint_name), *log.full_positions())
+			mask = log.in_window(distance_timestamps)
+			distances, distance_timestamps = distances[mask], distance_timestamps[mask]
+		elif log.mode == "spatial" or log.window is not None:
+			distances, distance_timestamps = get_spatial_distances(get_blueprint(log.blueprint_name).tree(), axes, timestamps)
+		else:
+			max_difference, max_timestamp, _, _ = get_axis_deviation(load_blueprint(log.blueprint_name), axes, timestamps, AXIS_THRESHOLD)
+			return {"max_deviation": float(max_difference), "max_deviation_timestamp": int(max_timestamp)}
+
+		index = distances.argmax() if len(distances) else None
+		return {
+			"max_deviation": float(distances[index]) if index is not None else 0.0,
+			"max_deviation_timestamp": int(distance_timestamps[index]) if index is not None else 0
+		}
+
+@register_extractor
+class Spatial_Deviation_Extractor(Metric_Extractor):
+	'''
+	Distribution of the spatial deviation (distance of every sample to the nearest blueprint
+	point) whatever the deviation mode, so in the axis and aligned modes these are a
+	different metric than max_deviation. Not part of CORE_EXTRACTORS: the nearest-neighbour
+	pass only runs when the full feature row is requested.
+	'''
+	name = "spatial_deviation"
+	topics = ("vehicle_local_position",)
+	features = ("spatial_rms_deviation", "spatial_p50_deviation", "spatial_p95_deviation")
+	needs_blueprint = True
+
+	def extract(self, log):
+		distances, _ = get_spatial_distances(get_blueprint(log.blueprint_name).tree(), *log.positions())
+		return {
+			"spatial_rms_deviation": float(np.sqrt(np.mean(distances ** 2))) if len(distances) else 0.0,
+			"spatial_p50_deviation": _percentile(distances, 50),
+			"spatial_p95_deviation": _percentile(distances, 95)
+		}
+
+@register_extractor
+class Altitude_Extractor(Metric_Extractor):
+	name = "altitude"
+	topics = ("vehicle_local_position",)
+	features = ("max_altitude",)
+
+	def extract(self, log):
+		(_, _, z), _ = log.positions()
+		return {"max_altitude": float(abs(np.nanmin(z)))}
+
+@register_extractor
+class Landing_Extractor(Metric_Extractor):
+	name = "landing"
+	topics = ("vehicle_land_detected",)
+	features = ("final_landing_state", "freefall_occurred")
+
+	def extract(self, log):
+		land_detected = log.data("vehicle_land_detected")
+		return {
+			"final_landing_state": bool(land_detected['landed'][-1]),
+			"freefall_occurred": bool(land_detected['freefall'].any())
+		}
+
+@register_extractor
+class Log_Extractor(Metric_Extractor):
+	'''
+	Duration and dropout statistics from the ULog header and index (no topic data needed).
+	For a segment the duration and timestamps are the segment's; dropouts are counted over the whole log.
+	'''
+	name = "log"
+	features = ("duration", "start_timestamp", "end_timestamp", "dropout_count", "dropout_total", "dropout_max")
+
+	def extract(self, log):
+		metadata = log.reader.metadata()
+		if log.window is not None:
+			metadata.update({
+				"start_timestamp": log.start_timestamp(),
+				"end_timestamp": log.end_timestamp(),
+				"duration": max(log.end_timestamp() - log.start_timestamp(), 0) / 1e6
+			})
+		return metadata
+
+@register_extractor
+class Vertical_Speed_Extractor(Metric_Extractor):
+	name = "vertical_speed"
+	topics = ("vehicle_local_position",)
+	features = ("max_climb_rate", "max_descent_rate")
+
+	def extract(self, log):
+		# NED: negative vz is climbing
+		vz = log.data("vehicle_local_position")['vz'].astype(np.float64)
+		vz = vz[np.isfinite(vz)]
+		if len(vz) == 0:
+			return {}
+		return {"max_climb_rate": max(float(-vz.min()), 0.0), "max_descent_rate": max(float(vz.max()), 0.0)}
+
+@register_extractor
+class Attitude_Extractor(Metric_Extractor):
+	'''Largest roll, pitch and tilt (angle from level) in degrees, from the attitude quaternion.'''
+	name = "attitude"
+	topics = ("vehicle_attitude",)
+	features = ("max_roll", "max_pitch", "max_tilt")
+
+	def extract(self, log):
+		q = log.data("vehicle_attitude")['q'].astype(np.float64)
+		w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+		roll = np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y))
+		pitch = np.arcsin(np.clip(2 * (w * y - z * x), -1, 1))
+		tilt = np.arccos(np.clip(1 - 2 * (x * x + y * y), -1, 1))
+		return {
+			"max_roll": float(np.degrees(np.nanmax(np.abs(roll)))),
+			"max_pitch": float(np.degrees(np.nanmax(np.abs(pitch)))),
+			"max_tilt": float(np.degrees(np.nanmax(tilt)))
+		}
+
+@register_extractor
+class Battery_Extractor(Metric_Extractor):
+	'''Remaining charge (0-1) at the start and end of the log, and its drop.'''
+	name = "battery"
+	topics = ("battery_status",)
+	features = ("battery_start", "battery_end", "battery_drop", "min_battery_voltage")
+
+	def extract(self, log):
+		battery = log.data("battery_status")
+		remaining = battery['remaining'].astype(np.float64)
+		voltage_field = 'voltage_v' if 'voltage_v' in battery.dtype.names else 'voltage_filtered_v'
+		values = {
+			"battery_start": float(remaining[0]),
+			"battery_end": float(remaining[-1]),
+			"battery_drop": float(remaining[0] - remaining[-1])
+		}
+		if voltage_field in battery.dtype.names:
+			values["min_battery_voltage"] = float(battery[voltage_field].min())
+		return values
+
+@register_extractor
+class Nav_State_Extractor(Metric_Extractor):
+	'''Seconds spent in each navigation state; a state lasts until the next vehicle_status sample or the end of the log.'''
+	name = "nav_state"
+	topics = ("vehicle_status",)
+	features = tuple("time_in_" + state for state in NAV_STATES.values()) + ("time_in_other",)
+
+	def extract(self, log):
+		status = log.data("vehicle_status")
+		timestamps = status['timestamp'].astype(np.int64)
+		end = max(int(timestamps[-1]), log.end_timestamp())
+		durations = np.diff(np.append(timestamps, end)) / 1e6
+		nav_states = status['nav_state']
+		values = {feature: 0.0 for feature in self.features}
+		for nav_state in np.unique(nav_states):
+			feature = "time_in_" + NAV_STATES.get(int(nav_state), "other")
+			values[feature] += float(durations[nav_states == nav_state].sum())
+		return values
@@ -0,0 +1,146 @@
+import threading
+import numpy as np
+from .ulog_reader import ULog_Stream
+
+"""
+In-flight deviation monitoring.
+
+Deviation_Monitor keeps max deviation, max altitude and freefall up to date while a
+mission is flying and sets its `failed` event as soon as the flight is clearly lost,
+so Fuzz_Testor can end the mission early instead of waiting for the time threshold.
+It can be fed from the live local position stream (ROS) or from Log_Follower, which
+tails the .ulg file that PX4 is still writing.
+"""
+
+#limits for calling a flight clearly failed (metres, NED local frame)
+MAX_DEVIATION_LIMIT = 50.0
+MAX_ALTITUDE_LIMIT = 60.0
+
+class Deviation_Monitor:
+	'''
+	Incrementally tracks how far a flight strays from the blueprint path.
+
+	Args:
+		tree (cKDTree): KD-tree over the blueprint positions (see blueprint_cache).
+		max_deviation_limit (float): 3D distance from the blueprint that fails the flight. None disables it.
+		max_altitude_limit (float): Altitude that fails the flight. None disables it.
+		fail_on_freefall (bool): Fail the flight as soon as freefall is detected.
+		on_failure (Callable[[str], None]): Optional callback, called once with the failure reason.
+	'''
+
+	def __init__(self, tree, max_deviation_limit=MAX_DEVIATION_LIMIT, max_altitude_limit=MAX_ALTITUDE_LIMIT,
+			fail_on_freefall=True, on_failure=None):
+		self.tree = tree
+		self.max_deviation_limit = max_deviation_limit
+		self.max_altitude_limit = max_altitude_limit
+		self.fail_on_freefall = fail_on_freefall
+		self.on_failure = on_failure
+		self.failed = threading.Event()
+		self.failure_reason = None
+		self._lock = threading.Lock()
+
+		self.max_deviation = 0.0
+		self.max_deviation_timestamp = 0
+		self.max_altitude = 0.0
+		self._min_z = float("inf")
+		self.freefall_occurred = False
+		self.landed = None
+		self.samples = 0
+
+	def update_position(self, timestamps, x, y, z):
+		'''Add one or more local position samples (NED, metres).'''
+		points = np.column_stack((np.atleast_1d(x), np.atleast_1d(y), np.atleast_1d(z))).astype(np.float64)
+		timestamps = np.atleast_1d(timestamps)
+		finite = np.isfinite(points).all(axis=1)
+		points, timestamps = points[finite], timestamps[finite]
+		if len(points) == 0:
+			return
+		distances, _ = self.tree.query(points)
+		index = distances.argmax()
+		min_z = float(points[:, 2].min())
+		with self._lock:
+			self.samples += len(points)
+			if distances[index] > self.max_deviation:
+				self.max_deviation = float(distances[index])
+				self.max_deviation_timestamp = int(timestamps[index])
+			# same definition as log_parser: abs of the lowest z (NED, up is negative)
+			self._min_z = min(self._min_z, min_z)
+			self.max_altitude = abs(self._min_z)
+		if self.max_deviation_limit is not None and self.max_deviation > self.max_deviation_limit:
+			self._fail('deviation {:.1f} m exceeds {:.1f} m'.format(self.max_deviation, self.max_deviation_limit))
+		elif self.max_altitude_limit is not None and self.max_altitude > self.max_altitude_limit:
+			self._fail('altitude {:.1f} m exceeds {:.1f} m'.format(self.max_altitude, self.max_altitude_limit))
+
+	def update_land_detected(self, timestamps, freefall, landed):
+		'''Add one or more vehicle_land_detected samples.'''
+		freefall = np.atleast_1d(freefall)
+		landed = np.atleast_1d(landed)
+		if len(landed) == 0:
+			return
+		with self._lock:
+			self.freefall_occurred = self.freefall_occurred or bool(freefall.any())
+			self.landed = bool(landed[-1])
+		if self.fail_on_freefall and self.freefall_occurred:
+			self._fail('freefall detected')
+
+	def summary(self):
+		with self._lock:
+			return {
+				"max_deviation": self.max_deviation,
+				"max_deviation_timestamp": self.max_deviation_timestamp,
+				"max_altitude": self.max_altitude,
+				"freefall_occurred": self.freefall_occurred,
+				"landed": self.landed,
+				"samples": self.samples,
+				"failure_reason": self.failure_reason
+			}
+
+	def _fail(self, reason):
+		with self._lock:
+			if self.failed.is_set():
+				return
+			self.failure_reason = reason
+			self.failed.set()
+		print('[stream_monitor] flight failed early:', reason)
+		if self.on_failure:
+			self.on_failure(reason)
+
+class Log_Follower:
+	'''
+	Tails a growing .ulg file in a background thread and feeds a Deviation_Monitor.
+
+	Args:
+		log_path (str): The .ulg file PX4 is writing (e.g. on a shared log volume).
+		monitor (Deviation_Monitor): Monitor to update.
+		interval (float): Seconds between polls of the file.
+	'''
+
+	def __init__(self, log_path, monitor, interval=0.5):
+		self.monitor = monitor
+		self.interval = interval
+		self.stream = ULog_Stream(log_path, topics=["vehicle_local_position", "vehicle_land_detected"])
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+		# pick up whatever was flushed after the last poll
+		self._poll()
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			self._poll()
+
+	def _poll(self):
+		records = self.stream.poll()
+		local_position = records.get(("vehicle_local_position", 0))
+		if local_position is not None:
+			self.monitor.update_position(local_position['timestamp'], local_position['x'], local_position['y'], local_position['z'])
+		land_detected = records.get(("vehicle_land_detected", 0))
+		if land_detected is not None:
+			self.monitor.update_land_detected(land_detected['timestamp'], land_detected['freefall'], land_detected['landed'])
@@ -0,0 +1,246 @@
+import struct
+import numpy as np
+
+"""
+Minimal in-process ULog decoder.
+
+Only the topics that are asked for are decoded, straight into NumPy structured
+arrays, so the analyzer does not need ulog2csv, temporary CSV files or a workspace.
+Format reference: https://docs.px4.io/main/en/dev_log/ulog_file_format.html
+"""
+
+ULOG_MAGIC = b'ULog\x01\x12\x35'
+HEADER_SIZE = 16
+MSG_HEADER_SIZE = 3
+
+ULOG_TYPES = {
+	'int8_t': 'i1',
+	'uint8_t': 'u1',
+	'int16_t': '<i2',
+	'uint16_t': '<u2',
+	'int32_t': '<i4',
+	'uint32_t': '<u4',
+	'int64_t': '<i8',
+	'uint64_t': '<u8',
+	'float': '<f4',
+	'double': '<f8',
+	'bool': '?',
+	'char': 'S1',
+}
+
+class ULog_Reader:
+	'''
+	Decodes the requested topics of a .ulg file into NumPy arrays.
+
+	Args:
+		file_path (str): Path to the .ulg file.
+		topics (Iterable[str]): Topic names to keep (e.g. 'vehicle_local_position').
+			If None, every logged topic is decoded.
+
+	Attributes:
+		start_timestamp (int): Log start in microseconds, taken from the file header.
+		last_timestamp (int): Largest timestamp seen in the data section.
+		info (dict): Information messages (sys_name, ver_hw, ...).
+		dropouts (List[Tuple[int, int]]): (timestamp, duration in ms) of every logger dropout.
+	'''
+
+	def __init__(self, file_path, topics=None):
+		self._init_state(file_path, topics)
+		with open(file_path, 'rb') as f:
+			self._buffer = f.read()
+		self._parse()
+
+	def _init_state(self, file_path, topics):
+		self.file_path = file_path
+		self.topics = set(topics) if topics is not None else None
+		self.info = {}
+		self.start_timestamp = 0
+		self.last_timestamp = 0
+		self.dropouts = []
+		self._formats = {}
+		self._dtypes = {}
+		# msg_id -> (topic name, multi_id)
+		self._subscriptions = {}
+		# (topic name, multi_id) -> list of (payload start, payload end)
+		self._offsets = {}
+		self._data = {}
+
+	def data(self, topic, multi_id=0):
+		'''Return the structured array for a topic instance, or None if it was not logged.'''
+		return self._data.get((topic, multi_id))
+
+	def has_topic(self, topic, multi_id=0):
+		return (topic, multi_id) in self._data
+
+	@property
+	def duration(self):
+		'''Logging duration in seconds.'''
+		return max(self.last_timestamp - self.start_timestamp, 0) / 1e6
+
+	def metadata(self):
+		'''Header and index metadata as plain numbers (timestamps in microseconds, durations in seconds).'''
+		dropout_durations = [duration for _, duration in self.dropouts]
+		return {
+			"start_timestamp": self.start_timestamp,
+			"end_timestamp": self.last_timestamp,
+			"duration": self.duration,
+			"dropout_count": len(dropout_durations),
+			"dropout_total": sum(dropout_durations) / 1e3,
+			"dropout_max": max(dropout_durations, default=0) / 1e3
+		}
+
+	def _parse(self):
+		self._parse_header()
+		self._parse_messages(HEADER_SIZE)
+		self._data = self._build_arrays()
+
+	def _parse_header(self):
+		buf = self._buffer
+		if len(buf) < HEADER_SIZE or buf[:7] != ULOG_MAGIC:
+			raise ValueError(f'[ulog_reader] {self.file_path} is not a ULog file')
+		self.start_timestamp, = struct.unpack_from('<Q', buf, 8)
+		self.last_timestamp = self.start_timestamp
+
+	def _parse_messages(self, pos):
+		'''Walk the complete messages in the buffer from pos and return the offset of the first incomplete one.'''
+		buf = self._buffer
+		end = len(buf)
+		last_timestamp = self.last_timestamp
+		while pos + MSG_HEADER_SIZE <= end:
+			msg_size, msg_type = struct.unpack_from('<HB', buf, pos)
+			payload = pos + MSG_HEADER_SIZE
+			# a truncated final message means the logger was stopped (or is still) mid-write
+			if payload + msg_size > end:
+				break
+			if msg_type == ord('D'):
+				msg_id, = struct.unpack_from('<H', buf, payload)
+				if msg_size >= 10:
+					timestamp, = struct.unpack_from('<Q', buf, payload + 2)
+					if timestamp > last_timestamp:
+						last_timestamp = timestamp
+				key = self._subscriptions.get(msg_id)
+				if key is not None:
+					self._offsets[key].append((payload + 2, payload + msg_size))
+			elif msg_type == ord('A'):
+				multi_id, msg_id = struct.unpack_from('<BH', buf, payload)
+				name = buf[payload + 3:payload + msg_size].decode('utf-8', 'replace')
+				if self.topics is None or name in self.topics:
+					key = (name, multi_id)
+					self._subscriptions[msg_id] = key
+					self._offsets.setdefault(key, [])
+			elif msg_type == ord('F'):
+				self._add_format(buf[payload:payload + msg_size].decode('utf-8', 'replace'))
+			elif msg_type == ord('I'):
+				self._add_info(buf, payload, msg_size)
+			elif msg_type == ord('L'):
+				timestamp, = struct.unpack_from('<Q', buf, payload + 1)
+				if timestamp > last_timestamp:
+					last_timestamp = timestamp
+			elif msg_type == ord('O'):
+				duration, = struct.unpack_from('<H', buf, payload)
+				self.dropouts.append((last_timestamp, duration))
+			pos = payload + msg_size
+		self.last_timestamp = last_timestamp
+		return pos
+
+	def _build_arrays(self, skip_empty=False):
+		arrays = {}
+		for key, offsets in self._offsets.items():
+			if offsets or not skip_empty:
+				arrays[key] = self._build_array(key[0], offsets)
+			offsets.clear()
+		return arrays
+
+	def _add_format(self, format_str):
+		name, _, fields = format_str.partition(':')
+		parsed = []
+		for field in fields.split(';'):
+			if not field:
+				continue
+			type_str, field_name = field.rsplit(' ', 1)
+			count = 1
+			if '[' in type_str:
+				type_str, count = type_str[:-1].split('[')
+				count = int(count)
+			parsed.append((type_str, count, field_name))
+		self._formats[name] = parsed
+
+	def _add_info(self, buf, payload, msg_size):
+		key_len = buf[payload]
+		key = buf[payload + 1:payload + 1 + key_len].decode('utf-8', 'replace')
+		value = buf[payload + 1 + key_len:payload + msg_size]
+		type_str, _, name = key.rpartition(' ')
+		if type_str.startswith('char'):
+			self.info[name] = value.decode('utf-8', 'replace').rstrip('\x00')
+		elif type_str in ULOG_TYPES:
+			self.info[name] = np.frombuffer(value, dtype=ULOG_TYPES[type_str])[0].item()
+
+	def _dtype(self, name, top_level=False):
+		if (name, top_level) in self._dtypes:
+			return self._dtypes[(name, top_level)]
+		fields = list(self._formats[name])
+		# the logger does not write padding at the end of a top-level message
+		if top_level:
+			while fields and fields[-1][2].startswith('_padding'):
+				fields.pop()
+		spec = []
+		for type_str, count, field_name in fields:
+			if type_str == 'char' and count > 1:
+				spec.append((field_name, 'S{}'.format(count)))
+				continue
+			base = ULOG_TYPES[type_str] if type_str in ULOG_TYPES else self._dtype(type_str)
+			spec.append((field_name, base, (count,)) if count > 1 else (field_name, base))
+		dtype = np.dtype(spec)
+		self._dtypes[(name, top_level)] = dtype
+		return dtype
+
+	def _build_array(self, name, offsets):
+		dtype = self._dtype(name, top_level=True)
+		size = dtype.itemsize
+		view = memoryview(self._buffer)
+		chunks = []
+		for start, stop in offsets:
+			chunk = view[start:min(stop, start + size)]
+			if len(chunk) < size:
+				chunk = bytes(chunk).ljust(size, b'\x00')
+			chunks.append(chunk)
+		return np.frombuffer(b''.join(chunks), dtype=dtype)
+
+class ULog_Stream(ULog_Reader):
+	'''
+	Follows a .ulg file that is still being written.
+
+	Each poll() reads only the bytes appended since the previous call and decodes the
+	complete messages among them; a partially written message is kept for the next poll.
+	'''
+
+	def __init__(self, file_path, topics=None):
+		self._init_state(file_path, topics)
+		self._buffer = b''
+		self._file_offset = 0
+		self._header_parsed = False
+
+	def poll(self):
+		'''Return {(topic, multi_id): new records} for the data appended since the last poll.'''
+		try:
+			with open(self.file_path, 'rb') as f:
+				f.seek(self._file_offset)
+				new_bytes = f.read()
+		except FileNotFoundError:
+			return {}
+		if not new_bytes:
+			return {}
+		self._file_offset += len(new_bytes)
+		self._buffer += new_bytes
+
+		pos = 0
+		if not self._header_parsed:
+			if len(self._buffer) < HEADER_SIZE:
+				return {}
+			self._parse_header()
+			self._header_parsed = True
+			pos = HEADER_SIZE
+		pos = self._parse_messages(pos)
+		records = self._build_arrays(skip_empty=True)
+		self._buffer = self._buffer[pos:]
+		return records
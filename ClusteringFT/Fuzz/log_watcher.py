@@ -0,0 +1,217 @@
+import ctypes
+import ctypes.util
+import glob
+import os
+import select
+import struct
+import threading
+import time
+
+'''
+Zero-copy log handoff through a shared volume.
+
+When the PX4 container's log directory (/home/user/Firmware/build/px4_sitl_default/logs)
+is bind-mounted into the fuzzing container, a Log_Watcher follows it with inotify and
+records every .ulg as PX4 creates and closes it. The tester gets the path of the finished
+log as soon as PX4 closes it -- no ls inside the container, no docker cp -- and the
+analyzer reads the log in place.
+
+On hosts without inotify (or where it does not see writes made through the mount) the
+watcher falls back to polling and treats a log as finished once its size settles.
+
+Log paths are relative to the log directory ("<date>/<time>.ulg"), like the paths
+Docker_Interface.get_latest_ulg_file() returns.
+'''
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_ISDIR = 0x40000000
+EVENT_HEADER = struct.Struct("iIII")
+WATCH_MASK = IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO
+
+#seconds between checks of the stop flag (inotify) or scans of the log directory (polling)
+POLL_INTERVAL = 0.5
+#polling only: seconds a log's size must stay unchanged before it counts as closed
+SETTLE_TIME = 3.0
+#finished logs remembered for wait_for_log
+HISTORY = 64
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+class Log_Watcher:
+    '''
+    Follows a PX4 log directory and hands out each mission's log once PX4 has closed it.
+
+    Usage: take mark() when a mission starts and call wait_for_log(mark, timeout) when it ends.
+
+    Args:
+        log_dir (str): Local mount point of the PX4 log directory.
+        use_inotify (bool): Set to False to force polling.
+    '''
+
+    def __init__(self, log_dir, use_inotify=True):
+        self.log_dir = log_dir
+        self._condition = threading.Condition()
+        #increases with every opened or closed log
+        self._sequence = 0
+        #relative path -> sequence at which the log was opened
+        self._opened = {}
+        #(sequence at close, relative path), oldest first
+        self._closed = []
+        self._stop = threading.Event()
+        self._libc = _load_inotify() if use_inotify else None
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+            if self._fd < 0:
+                self._libc = None
+        if self._libc is not None:
+            # directory watch descriptor -> directory relative to log_dir ("" is log_dir itself)
+            self._watches = {}
+            self._add_watch("")
+            for directory in sorted(os.listdir(log_dir)):
+                if os.path.isdir(os.path.join(log_dir, directory)):
+                    self._add_watch(directory)
+            target = self._watch_events
+        else:
+            print('[log_watcher] polling', log_dir)
+            target = self._poll
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def path(self, ulg_file_path):
+        return os.path.join(self.log_dir, ulg_file_path)
+
+    def mark(self):
+        '''Position in the log stream; wait_for_log(mark) only returns logs opened after it.'''
+        with self._condition:
+            return self._sequence
+
+    def wait_for_log(self, since, timeout):
+        '''
+        Wait up to timeout seconds for the first log opened after since to be closed and return
+        its relative path. If none is closed in time (e.g. PX4 is still armed when a mission
+        times out), the first log opened after since is returned as it is; None if there is none.
+        '''
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                for sequence, ulg_file_path in self._closed:
+                    if self._opened.get(ulg_file_path, sequence) > since:
+                        return ulg_file_path
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            opened = [(sequence, ulg_file_path) for ulg_file_path, sequence in self._opened.items() if sequence > since]
+            return min(opened)[1] if opened else None
+
+    def wait_for_open(self, since, timeout):
+        '''Wait up to timeout seconds for a log to be opened after since and return its relative path (None if none was).'''
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                opened = [(sequence, ulg_file_path) for ulg_file_path, sequence in self._opened.items() if sequence > since]
+                if opened:
+                    return min(opened)[1]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join()
+        if self._libc is not None:
+            os.close(self._fd)
+
+    def _log_opened(self, ulg_file_path):
+        with self._condition:
+            if ulg_file_path in self._opened:
+                return
+            self._sequence += 1
+            self._opened[ulg_file_path] = self._sequence
+            self._condition.notify_all()
+
+    def _log_closed(self, ulg_file_path):
+        with self._condition:
+            self._sequence += 1
+            self._closed.append((self._sequence, ulg_file_path))
+            if len(self._closed) > HISTORY:
+                forgotten = self._closed.pop(0)[1]
+                self._opened.pop(forgotten, None)
+            self._condition.notify_all()
+
+    def _add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(os.path.join(self.log_dir, directory)), WATCH_MASK)
+        if wd < 0:
+            print(f'[log_watcher] cannot watch {directory or self.log_dir}: {os.strerror(ctypes.get_errno())}')
+            return
+        self._watches[wd] = directory
+        if directory:
+            # the first log of a new date directory can be created before the watch is in place
+            for log in sorted(glob.glob(os.path.join(self.log_dir, directory, "*.ulg"))):
+                self._log_opened(os.path.join(directory, os.path.basename(log)))
+
+    def _watch_events(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], POLL_INTERVAL)
+            if not ready:
+                continue
+            buffer = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                name = os.fsdecode(buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0"))
+                offset += EVENT_HEADER.size + length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd, mask, name):
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_ISDIR:
+            # PX4 starts a new date directory
+            if directory == "" and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watch(name)
+            return
+        if not name.endswith(".ulg"):
+            return
+        ulg_file_path = os.path.join(directory, name)
+        if mask & IN_CREATE:
+            self._log_opened(ulg_file_path)
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._log_opened(ulg_file_path)
+            self._log_closed(ulg_file_path)
+
+    def _scan(self):
+        sizes = {}
+        for log in glob.glob(os.path.join(self.log_dir, "*", "*.ulg")):
+            try:
+                sizes[os.path.relpath(log, self.log_dir)] = os.path.getsize(log)
+            except OSError:
+                # removed between the glob and the stat
+                continue
+        return sizes
+
+    def _poll(self):
+        # relative path -> [size, time of the last size change, closed]; logs already present count as closed
+        logs = {ulg_file_path: [size, 0.0, True] for ulg_file_path, size in self._scan().items()}
+        while not self._stop.wait(POLL_INTERVAL):
+            now = time.monotonic()
+            for ulg_file_path, size in sorted(self._scan().items()):
+                state = logs.get(ulg_file_path)
+                if state is None:
+                    logs[ulg_file_path] = [size, now, False]
+                    self._log_opened(ulg_file_path)
+                elif state[0] != size:
+                    state[0], state[1] = size, now
+                elif not state[2] and now - state[1] >= SETTLE_TIME:
+                    state[2] = True
+                    self._log_closed(ulg_file_path)
@@ -0,0 +1,109 @@
+import heapq
+import itertools
+import threading
+import time
+
+'''
+Event-driven mission deadlines.
+
+Mission_Watchdog keeps one deadline per mission key in a heap and its thread sleeps on a
+condition variable until the earliest deadline (or until a schedule/cancel changes it),
+so nothing polls while missions fly. Cancelled and rescheduled deadlines are left in the
+heap and skipped when they surface, which keeps every operation O(log n).
+'''
+
+class Mission_Watchdog:
+    '''
+    Timer heap that calls a callback when a mission runs past its deadline.
+
+    Every expired mission's callback runs in its own thread, so a slow abort of one
+    mission never delays the deadline of another.
+
+    Example:
+        watchdog = Mission_Watchdog()
+        watchdog.schedule("Polkadot", 75, on_timeout)   # on_timeout("Polkadot") after 75 s
+        watchdog.reschedule("Polkadot", 0)              # expire right away
+        watchdog.cancel("Polkadot")                      # mission finished in time
+    '''
+
+    def __init__(self):
+        self._heap = []
+        # key -> (deadline, generation, callback) of the live deadline
+        self._entries = {}
+        self._generations = itertools.count()
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="mission_watchdog", daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, timeout, callback):
+        '''Call callback(key) in timeout seconds, replacing any deadline the mission already had.'''
+        with self._condition:
+            self._push(key, time.monotonic() + timeout, callback)
+
+    def reschedule(self, key, timeout):
+        '''Move a mission's deadline to timeout seconds from now. Returns False if it has none.'''
+        with self._condition:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            self._push(key, time.monotonic() + timeout, entry[2])
+            return True
+
+    def cancel(self, key):
+        '''Drop a mission's deadline. Returns False if it had none (e.g. it already expired).'''
+        with self._condition:
+            if self._entries.pop(key, None) is None:
+                return False
+            self._condition.notify()
+            return True
+
+    def remaining(self, key):
+        '''Seconds until the mission's deadline, or None if it has none.'''
+        with self._condition:
+            entry = self._entries.get(key)
+            return None if entry is None else max(entry[0] - time.monotonic(), 0.0)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._entries.clear()
+            self._condition.notify()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _push(self, key, deadline, callback):
+        generation = next(self._generations)
+        self._entries[key] = (deadline, generation, callback)
+        heapq.heappush(self._heap, (deadline, generation, key))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                expired = self._next_expired()
+                if expired is None:
+                    return
+            key, callback = expired
+            threading.Thread(target=callback, args=(key,), name=f"mission_timeout_{key}", daemon=True).start()
+
+    def _next_expired(self):
+        # called with the condition held; sleeps until a live deadline passes
+        while not self._stopped:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            deadline, generation, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != generation:
+                # cancelled or rescheduled since it was pushed
+                heapq.heappop(self._heap)
+                continue
+            now = time.monotonic()
+            if deadline > now:
+                self._condition.wait(deadline - now)
+                continue
+            heapq.heappop(self._heap)
+            del self._entries[key]
+            return key, entry[2]
+        return None
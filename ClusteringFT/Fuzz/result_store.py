@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+'''
+Append-only result store.
+
+Every mission record (fuzz_common.make_record) becomes one row of an SQLite database in
+WAL mode, with typed columns for the make_record fields and indexes on the test tuple,
+the log file and the outcome, so campaign queries and resume lookups do not scan the
+whole history. The log metadata and the metric feature row are stored as JSON text.
+
+The database replaces Fuzz_Test_Logs.txt (pretty-printed JSON objects written back to
+back, not valid JSON or JSONL). Existing files are imported with:
+    python result_store.py --import Fuzz_Test_Logs.txt
+and a store is queried from the Fuzz directory with e.g.
+    python result_store.py --mission "('ALTCTL', 'Takeoff')"
+'''
+
+#default store, created in the working directory like the old Fuzz_Test_Logs.txt
+RESULT_STORE = "fuzz_results.db"
+#legacy results file of write_to_file
+LEGACY_RESULTS_FILE = "Fuzz_Test_Logs.txt"
+
+#make_record field -> column type; booleans are stored as 0/1
+COLUMNS = {
+    "filename": "TEXT",
+    "mission": "TEXT",
+    "max_deviation": "REAL",
+    "max_altitude": "REAL",
+    "duration": "REAL",
+    "final_landing_state": "INTEGER",
+    "freefall_occurred": "INTEGER",
+    "mission_complete": "INTEGER",
+    "uav_id": "TEXT",
+    "log_metadata": "TEXT",
+    "features": "TEXT",
+    "injection": "INTEGER",
+    "segment": "TEXT",
+    "recovered": "INTEGER"
+}
+BOOLEAN_COLUMNS = ("final_landing_state", "freefall_occurred", "mission_complete", "recovered")
+JSON_COLUMNS = ("log_metadata", "features", "segment")
+INDEXES = {
+    "results_mission": "mission",
+    "results_filename": "filename",
+    "results_outcome": "mission_complete, final_landing_state"
+}
+
+def _read_legacy_line(line, decoder):
+    # oldest format, one mission per line: "<log file>, <test tuple>, <json message>, "
+    filename, rest = line.split(", ", 1)
+    end = rest.index("), ") + 1
+    record = {"filename": filename, "mission": rest[:end]}
+    record.update(decoder.raw_decode(rest, end + 2)[0])
+    return record
+
+def read_legacy_results(file_path, offset=0):
+    '''
+    Parse a legacy Fuzz_Test_Logs.txt from offset on: concatenated (indented) JSON objects as
+    written by write_to_file, or the older one-line "<log file>, <test tuple>, <json>, " records.
+    '''
+    if not os.path.exists(file_path):
+        return []
+    with open(file_path, 'r') as f:
+        f.seek(offset)
+        text = f.read()
+    decoder = json.JSONDecoder()
+    records = []
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            break
+        if text[pos] == "{":
+            record, pos = decoder.raw_decode(text, pos)
+        else:
+            end = text.find("\n", pos)
+            end = len(text) if end < 0 else end
+            record = _read_legacy_line(text[pos:end], decoder)
+            pos = end
+        records.append(record)
+    return records
+
+class Result_Store:
+    '''
+    One row per flown mission.
+
+    Safe to share between threads (e.g. the analysis worker and the MQTT callbacks), and
+    several processes can append to the same file; readers never block the writer.
+
+    Args:
+        path (str): Database file. Created with its schema if it does not exist.
+    '''
+
+    def __init__(self, path=RESULT_STORE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self._lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # WAL keeps committed rows durable across crashes of the process; NORMAL only risks the last commits on power loss
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            columns = ", ".join(f"{name} {column_type}" for name, column_type in COLUMNS.items())
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, recorded_at REAL, {columns})")
+            # stores created before a column was added get it appended (NULL for the old rows)
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(results)")}
+            for name, column_type in COLUMNS.items():
+                if name not in existing:
+                    self.connection.execute(f"ALTER TABLE results ADD COLUMN {name} {column_type}")
+            for index, indexed in INDEXES.items():
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {index} ON results ({indexed})")
+
+    def append(self, record, uav_id=None):
+        '''Store one make_record record and return its row id.'''
+        values = [time.time()]
+        for name in COLUMNS:
+            value = uav_id if name == "uav_id" and uav_id is not None else record.get(name)
+            if name in JSON_COLUMNS and value is not None:
+                value = json.dumps(value)
+            elif name in BOOLEAN_COLUMNS and value is not None:
+                value = int(bool(value))
+            values.append(value)
+        placeholders = ", ".join("?" * len(values))
+        with self._lock, self.connection:
+            cursor = self.connection.execute(f"INSERT INTO results (recorded_at, {', '.join(COLUMNS)}) VALUES ({placeholders})", values)
+        return cursor.lastrowid
+
+    def last_id(self):
+        '''Id of the newest row (0 for an empty store); records(after_id=...) returns what was added since.'''
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM results").fetchone()[0]
+
+    def records(self, mission=None, filename=None, mission_complete=None, after_id=0):
+        '''Rows as make_record records (plus uav_id and recorded_at), oldest first, optionally filtered.'''
+        conditions = ["id > ?"]
+        values = [after_id]
+        for name, value in (("mission", mission), ("filename", filename), ("mission_complete", mission_complete)):
+            if value is not None:
+                conditions.append(f"{name} = ?")
+                values.append(int(value) if name in BOOLEAN_COLUMNS else value)
+        with self._lock:
+            rows = self.connection.execute(f"SELECT * FROM results WHERE {' AND '.join(conditions)} ORDER BY id", values).fetchall()
+        return [self._record(row) for row in rows]
+
+    def missions(self):
+        '''Every test tuple (as recorded, str(tuple)) with at least one result, for resume lookups.'''
+        with self._lock:
+            return {row[0] for row in self.connection.execute("SELECT DISTINCT mission FROM results")}
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _record(self, row):
+        record = {name: row[name] for name in COLUMNS}
+        for name in BOOLEAN_COLUMNS:
+            if record[name] is not None:
+                record[name] = bool(record[name])
+        for name in JSON_COLUMNS:
+            if record[name] is not None:
+                record[name] = json.loads(record[name])
+        record["recorded_at"] = row["recorded_at"]
+        return record
+
+def import_legacy(file_path, store):
+    '''
+    Append the records of a legacy Fuzz_Test_Logs.txt to store and return how many were added.
+    Records already in the store (same log file and mission) are skipped, so an import can be rerun.
+    '''
+    existing = {(record["filename"], record["mission"]) for record in store.records()}
+    count = 0
+    for record in read_legacy_results(file_path):
+        if (record.get("filename"), record.get("mission")) in existing:
+            continue
+        store.append(record)
+        count += 1
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import legacy results into, or query, a fuzz result store.")
+    parser.add_argument('--db', default=RESULT_STORE, help='Result store file.')
+    parser.add_argument('--import', dest='legacy', metavar='FILE', default=None, help='Legacy Fuzz_Test_Logs.txt to import.')
+    parser.add_argument('--mission', default=None, help='Only missions with this test tuple, e.g. "(\'ALTCTL\', \'Takeoff\')".')
+    parser.add_argument('--filename', default=None, help='Only missions with this log file.')
+    parser.add_argument('--failed', action='store_true', help='Only missions that did not complete.')
+    args = parser.parse_args()
+
+    store = Result_Store(args.db)
+    if args.legacy:
+        print(f'[result_store] imported {import_legacy(args.legacy, store)} records from {args.legacy}')
+    else:
+        for record in store.records(args.mission, args.filename, False if args.failed else None):
+            print(json.dumps(record))
+    store.close()
@@ -0,0 +1,109 @@
+import json
+import os
+import pickle
+import threading
+import time
+
+'''
+Append-only journal of executed test tuples.
+
+Each executed test is one JSON line appended to the journal, so recording a test costs
+one short write instead of re-pickling the whole executed set. Writes are flushed
+immediately (they survive a crash of the fuzzing process) and fsynced in batches (they
+survive a host crash up to the last batch). A line torn by a crash mid-write is dropped
+when the journal is reopened, so the journal always replays cleanly.
+
+replay() only reads what was appended since the previous replay, so resuming a long
+campaign does not re-read the whole history.
+'''
+
+#default journal, created in the working directory
+JOURNAL_FILE = "executed_tests.journal"
+#pickled executed-test set the journal replaces; imported once when no journal exists yet
+LEGACY_PICKLE = "executed_tests.pkl"
+#fsync after this many appended tests ...
+FSYNC_BATCH = 16
+#... or once the oldest unsynced test is this many seconds old
+FSYNC_INTERVAL = 5.0
+
+class Test_Journal:
+    '''
+    Args:
+        path (str): Journal file. Created if it does not exist.
+        legacy_pickle (str): executed_tests.pkl to import into a new journal. None to skip.
+    '''
+
+    def __init__(self, path=JOURNAL_FILE, legacy_pickle=LEGACY_PICKLE):
+        self.path = path
+        self._lock = threading.Lock()
+        #bytes of the journal already returned by replay()
+        self._offset = 0
+        self._unsynced = 0
+        self._first_unsynced = None
+        new_journal = not os.path.exists(path)
+        self._drop_torn_line()
+        self._file = open(path, 'a')
+        if new_journal and legacy_pickle and os.path.exists(legacy_pickle):
+            self._import_pickle(legacy_pickle)
+
+    def append(self, test):
+        '''Record one executed test tuple.'''
+        line = json.dumps(list(test)) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._unsynced += 1
+            if self._first_unsynced is None:
+                self._first_unsynced = time.monotonic()
+            if self._unsynced >= FSYNC_BATCH or time.monotonic() - self._first_unsynced >= FSYNC_INTERVAL:
+                self._sync()
+
+    def replay(self):
+        '''Return the set of test tuples appended since the previous replay (everything on the first call).'''
+        with self._lock:
+            self._file.flush()
+            with open(self.path, 'r') as f:
+                f.seek(self._offset)
+                text = f.read()
+        # an unterminated line is still being written; it is read by the next replay
+        complete = text[:text.rfind("\n") + 1]
+        self._offset += len(complete.encode())
+        return {tuple(json.loads(line)) for line in complete.splitlines() if line}
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def _sync(self):
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._first_unsynced = None
+
+    def _drop_torn_line(self):
+        # a crash mid-append leaves an unterminated last line; cut it so new entries start on a line of their own
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                print(f'[test_journal] dropping a torn entry at the end of {self.path}')
+                f.truncate(end)
+
+    def _import_pickle(self, legacy_pickle):
+        try:
+            with open(legacy_pickle, 'rb') as f:
+                tests = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            print(f'[test_journal] {legacy_pickle} is truncated, not importing it')
+            return
+        for test in sorted(tests, key=repr):
+            self.append(test)
+        self.sync()
+        print(f'[test_journal] imported {len(tests)} executed tests from {legacy_pickle}')
@@ -6,7 +6,7 @@ Assume here that the input variable fuzz_testor_output is in this format -
     "mission": "(0, 5)",
     "max_deviation": 33.531126164,
     "max_altitude": 4.9189122e-05,
-    "duration": "0:01:23",
+    "duration": 83.0,
     "final_landing_state": true,
     "freefall_occurred": false,
     "mission_complete": false
@@ -18,12 +18,27 @@ import pandas as pd
 import ast
 
 
+def duration_seconds(duration):
+    '''
+    Mission duration in seconds. The log analyzer reports seconds as a number,
+    older logs and L1_TESTS_FINAL_SUBMISSION.csv still hold "H:MM:SS" strings.
+    None if the duration is unknown (None or NaN, e.g. no log was written for the mission).
+    '''
+    if duration is None or (not isinstance(duration, str) and pd.isna(duration)):
+        return None
+    if isinstance(duration, str):
+        return pd.to_timedelta(duration).total_seconds()
+    return float(duration)
+
+
 def decision_tree(self, index, ones_columns, fuzz_testor_output):
         output_dict = json.loads(fuzz_testor_output)
         mission_list = list(ast.literal_eval(output_dict['mission']))
         print('[Debug] output_dict - ', output_dict)
         print('[Debug] mission_list - ', mission_list)
         anomaly = False
+        # None without a log; the duration rule is skipped then
+        duration = duration_seconds(output_dict['duration'])
         if 'AUTO.LAND' in mission_list and 'Takeoff' not in mission_list:
             if output_dict['final_landing_state'] != True:
                 anomaly = True
@@ -43,7 +58,7 @@ def decision_tree(self, index, ones_columns, fuzz_testor_output):
                     elif action != 'None':
                         if int(output_dict['max_deviation']) < 10 or output_dict['mission_complete'] == True:
                             anomaly=True
-        elif pd.to_timedelta(output_dict['duration']).total_seconds() < 40:
+        elif duration is not None and duration < 40:
             anomaly = True
         elif output_dict['mission_complete'] == False and (int(output_dict['max_deviation']) > 2 or (int(output_dict['max_altitude']) < 10 or int(output_dict['max_altitude']) > 15)):
             anomaly = True
@@ -1,13 +1,23 @@
+import numpy as np
 import pandas as pd
 from itertools import combinations
 import Clustering as clt
 import random
 import FaultTreeHelper
+from decisionTreeLogic import duration_seconds
 import json
 from Fuzz import FuzzTestor as ft
+from Fuzz.result_store import RESULT_STORE
+from Fuzz.test_journal import JOURNAL_FILE, LEGACY_PICKLE
 import os
 import ast  
 import itertools
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from Fuzz.campaign import load_stacks, run_stack
+from probe_cache import PROBE_CACHE, Probe_Cache, canonical_fuzz_args, probe_key
 
 MODES = ['ALTCTL', 'POSCTL', 'OFFBOARD', 'STABILIZED', 'AUTO.LOITER', 'AUTO.RTL', 'AUTO.LAND']
 MODES_MAP = {'LOITER': 'AUTO.LOITER', 'RTL':'AUTO.RTL', 'LAND': 'AUTO.LAND'}
@@ -26,11 +36,212 @@ STATES_MAPPING = {
 # GEOFENCE_ACTION = {"None" : 0}
 ANOMALY_FILE = 'probes2.json'
 LOGIC_FILE = 'logic.txt'
+#times a failed probe is sent to a stack again before the pipeline gives up
+PROBE_RETRIES = 1
+#prefixes a truth table row needs at least one column of (any one of these sets) to be flown
+VALID_COMBINATIONS = [
+    ['GFACT'],
+    ['GFACT', 'modes'],
+    ['GFACT', 'modes', 'throttle'],
+    ['states', 'modes'],
+    ['states', 'throttle'],
+    ['states', 'modes', 'throttle']
+]
+#flights without a change of the partial logic function after which adaptive mode stops
+STABLE_PROBES = 5
+#seed of the choices create_fuzz_args makes (flying state, low throttle), so a row always maps to the same probe
+PROBE_SEED = 0
+
+def remove_probe_files(directory='.'):
+    '''
+    Delete the executed-test journal and the result store a probe leaves in directory, and any
+    legacy executed_tests.pkl: a new journal imports it, so a stale one would mark the probe's
+    tests as done and the probe would finish without flying.
+    '''
+    for file_name in (JOURNAL_FILE, LEGACY_PICKLE, RESULT_STORE, RESULT_STORE + '-wal', RESULT_STORE + '-shm'):
+        try:
+            os.remove(os.path.join(directory, file_name))
+        except FileNotFoundError:
+            pass
+
+def run_probe(stack, fuzz_args):
+    '''
+    Fly one probe on a vehicle stack and return the fuzz testor output (JSON) of its last mission.
+    Runs in the stack's own process, in the stack's working directory (see campaign.run_stack).
+    '''
+    # the worker process is reused for the stack's next probe, and run_stack changes into the
+    # (relative) stack working directory, so come back to resolve it from the same place again
+    cwd = os.getcwd()
+    try:
+        # every probe starts from an empty journal and result store, like run_probes
+        remove_probe_files(stack.working_directory())
+        records = run_stack(stack, ft.Fuzz_Test(**fuzz_args))
+        remove_probe_files()
+    finally:
+        os.chdir(cwd)
+    if not records:
+        raise RuntimeError(f'[ClusteringFT] probe {fuzz_args} on {stack.uav_id} recorded no mission')
+    return json.dumps(records[-1], indent=4)
+
+def feasible_groups(present):
+    '''
+    Whether a row setting exactly the prefix groups in present can be flown: GFACT and states
+    are never set together, a state alone is not a probe, and the groups have to cover one of
+    VALID_COMBINATIONS. feasible_rows and validate_combinations both decide through here.
+    '''
+    tags = {tag for combination in VALID_COMBINATIONS for tag in combination}
+    present_tags = {tag for tag in tags if any(prefix.startswith(tag) for prefix in present)}
+    if 'GFACT' in present and 'states' in present:
+        return False
+    if len(present) == 1 and 'states' in present_tags:
+        return False
+    return any(all(tag in present_tags for tag in combination) for combination in VALID_COMBINATIONS)
+
+def feature_groups(features):
+    '''Column indexes of each prefix group (the part of a column name before the first '_').'''
+    groups = {}
+    for bit, col in enumerate(features):
+        groups.setdefault(col.split('_')[0], []).append(bit)
+    return groups
+
+def feasible_rows(features):
+    '''
+    Lazily yield the truth table rows (tuples of 0/1 in features order) that can be flown:
+    at most one column per prefix group (the groups are one-hot) and a set of groups
+    feasible_groups accepts. Cost grows with the feasible rows, not 2^n; the rows never
+    yielded are don't-cares of the logic function.
+    '''
+    groups = feature_groups(features)
+    prefixes = list(groups)
+
+    for count in range(1, len(prefixes) + 1):
+        for present in combinations(prefixes, count):
+            if not feasible_groups(present):
+                continue
+            for members in itertools.product(*(groups[prefix] for prefix in present)):
+                row = [0] * len(features)
+                for bit in members:
+                    row[bit] = 1
+                yield tuple(row)
+
+def popcount(values):
+    '''Number of set bits of each element of a uint64 array.'''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    # numpy < 2.0: count per byte through a lookup table
+    table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+def validate_combinations(truthTable):
+    '''
+    Boolean mask of the rows of a truth table (generated or loaded) that feasible_rows would
+    yield. Every row is checked at once: it is packed into an integer with one bit per
+    feature column, the one-hot rule becomes a popcount per group mask, and the groups a row
+    sets become a small code looked up in a table of feasible_groups answers.
+    '''
+    features = [col for col in truthTable.columns if col != 'result']
+    groups = feature_groups(features)
+    prefixes = list(groups)
+    codes = np.zeros(len(truthTable), dtype=np.uint64)
+    for bit, col in enumerate(features):
+        codes |= (truthTable[col].to_numpy() == 1).astype(np.uint64) << np.uint64(bit)
+
+    valid = np.ones(len(codes), dtype=bool)
+    present = np.zeros(len(codes), dtype=np.int64)
+    for group, prefix in enumerate(prefixes):
+        members = codes & np.uint64(sum(1 << bit for bit in groups[prefix]))
+        # Check if any prefix appears more than once
+        valid &= popcount(members) <= 1
+        present |= (members != 0).astype(np.int64) << group
+
+    # one feasible_groups call per distinct set of groups, not per row
+    seen, inverse = np.unique(present, return_inverse=True)
+    table = np.array([feasible_groups([prefix for group, prefix in enumerate(prefixes) if code >> group & 1])
+                      for code in seen], dtype=bool)
+    return valid & table[inverse.reshape(-1)]
+
+def load_truth_table(path):
+    '''
+    Read a truth table CSV (as run_pipeline writes it) and keep its feasible rows only, so
+    infeasible rows a hand-edited or older table still lists become don't-cares again.
+    '''
+    truthTable = pd.read_csv(path)
+    feasible = validate_combinations(truthTable)
+    if not feasible.all():
+        print(f'[ClusteringFT] Dropping {int((~feasible).sum())} infeasible rows of {path}')
+    truthTable = truthTable[feasible].reset_index(drop=True)
+    truthTable['result'] = truthTable['result'].astype(int)
+    return truthTable
+
+class Probe_Pool():
+    '''
+    Flies probes in parallel, one worker process bound to each vehicle stack.
+    A stack gets its next probe as soon as its current one finishes, so a truth table
+    fills in about the time of its slowest probes instead of the sum of all of them.
+
+    Args:
+        stacks (List[Vehicle_Stack]): The stacks to fly on (campaign.Vehicle_Stack).
+    '''
+
+    def __init__(self, stacks):
+        if len({stack.uav_id for stack in stacks}) != len(stacks):
+            raise ValueError('[ClusteringFT] every vehicle stack needs its own uav_id')
+        self.stacks = stacks
+
+    def run(self, probes, on_result):
+        '''
+        Fly every (key, fuzz_args) probe and call on_result(key, output) in the calling
+        thread as each one finishes.
+        '''
+        pending = deque((key, fuzz_args, 0) for key, fuzz_args in probes)
+        # spawn: every stack gets a fresh interpreter (own rospy node, MQTT client and environment)
+        context = multiprocessing.get_context('spawn')
+        executors = {stack.uav_id: ProcessPoolExecutor(max_workers=1, mp_context=context) for stack in self.stacks}
+        running = {}
+
+        def submit(stack):
+            key, fuzz_args, attempts = pending.popleft()
+            print(f'[ClusteringFT] Running Probe on {stack.uav_id} - ', fuzz_args)
+            future = executors[stack.uav_id].submit(run_probe, stack, fuzz_args)
+            running[future] = (stack, key, fuzz_args, attempts)
+
+        try:
+            for stack in self.stacks:
+                if pending:
+                    submit(stack)
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stack, key, fuzz_args, attempts = running.pop(future)
+                    try:
+                        output = future.result()
+                    except Exception as e:
+                        if attempts >= PROBE_RETRIES:
+                            raise
+                        print(f'[ClusteringFT] probe {fuzz_args} failed on {stack.uav_id}, retrying: {e}')
+                        pending.append((key, fuzz_args, attempts + 1))
+                    else:
+                        on_result(key, output)
+                    if pending:
+                        submit(stack)
+        finally:
+            for executor in executors.values():
+                executor.shutdown(cancel_futures=True)
 
 class ClusteringFT():
 
-    def __init__(self) -> None:
+    def __init__(self, stacks=None, probe_cache=PROBE_CACHE, adaptive=False, flight_budget=None, stable_probes=STABLE_PROBES) -> None:
         
+        #vehicle stacks to fly probes on in parallel; None flies them one by one on the default stack
+        self.probe_pool = Probe_Pool(stacks) if stacks else None
+        #outputs of probes flown before (in any truth table or run) are answered from here; None disables it
+        self.probe_cache = Probe_Cache(probe_cache) if probe_cache else None
+        #fly the most informative rows first and stop early (run_adaptive) instead of flying every row
+        self.adaptive = adaptive
+        #most flights per truth table in adaptive mode; None for no limit
+        self.flight_budget = flight_budget
+        #adaptive mode stops once the logic function is unchanged for this many flights
+        self.stable_probes = stable_probes
         self.fuzz_test_args = {}
         self.cases = []
         self.truthTable = pd.DataFrame()
@@ -60,6 +271,8 @@ class ClusteringFT():
         print('[Debug] output_dict - ', output_dict)
         print('[Debug] mission_list - ', mission_list)
         anomaly = False
+        # None without a log; the duration rule is skipped then
+        duration = duration_seconds(output_dict['duration'])
         if 'AUTO.LAND' in mission_list and 'Takeoff' not in mission_list:
             if output_dict['final_landing_state'] != True:
                 anomaly = True
@@ -79,7 +292,7 @@ class ClusteringFT():
                     elif action != 'None':
                         if int(output_dict['max_deviation']) < 10 or output_dict['mission_complete'] == True:
                             anomaly=True
-        elif pd.to_timedelta(output_dict['duration']).total_seconds() < 40:
+        elif duration is not None and duration < 40:
             anomaly = True
         elif output_dict['mission_complete'] == False and (int(output_dict['max_deviation']) > 2 or (int(output_dict['max_altitude']) < 10 or int(output_dict['max_altitude']) > 15)):
             anomaly = True
@@ -110,52 +323,12 @@ class ClusteringFT():
         
         return 0
 
-    def validate_combinations(self):
-        for index, row in self.truthTable.iterrows():
-            # Get the columns that have ones
-            ones_columns = [col for col in self.truthTable.columns if row[col] == 1]
-            # Get the prefixes of these columns
-            prefixes = [col.split('_')[0] for col in ones_columns]
-
-            # Check if any prefix appears more than once
-            if len(set(prefixes)) < len(prefixes):
-                self.truthTable.at[index, 'result'] = 0
-                continue
-
-            #  # Check if both 'GFACT' and 'states' are set to 1
-            if 'GFACT' in prefixes and 'states' in prefixes:
-                self.truthTable.at[index, 'result'] = 0
-                continue
-
-            # Check if a single state column is 1 and all others are 0
-            if len(ones_columns) == 1 and ones_columns[0].startswith('states'):
-                self.truthTable.at[index, 'result'] = 0
-                continue
-
-            # Check valid combinations
-            valid_combinations = [
-                ['GFACT'],
-                ['GFACT', 'modes'],
-                ['GFACT', 'modes', 'throttle'],
-                ['states', 'modes'],
-                ['states', 'throttle'],
-                ['states', 'modes', 'throttle']
-            ]
-
-            valid = False
-            for combination in valid_combinations:
-                if all(any(ones.startswith(prefix) for ones in ones_columns) for prefix in combination):
-                    valid = True
-                    break
-
-            if not valid:
-                self.truthTable.at[index, 'result'] = 0
-        return
-    
     def create_fuzz_args(self, valid_combinations):
         special_dicts = []
         print(valid_combinations)
         fuzz_test_args = {'drone_id': 'Polkadot'}
+        # seeded by the row, so the same row always picks the same state and throttle
+        rng = random.Random(f"{PROBE_SEED}:{','.join(sorted(valid_combinations))}")
         for combination in valid_combinations:
             prefix, suffix = combination.split('_', 1)
 
@@ -166,7 +339,7 @@ class ClusteringFT():
                 if suffix == 'Hover':
                     suffix = STATES_MAPPING['Hover']
                 elif suffix == 'Flying':
-                    suffix = random.choice(STATES_MAPPING['Flying'])
+                    suffix = rng.choice(STATES_MAPPING['Flying'])
 
             elif prefix == 'modes' and suffix in ['LOITER', 'RTL', 'LAND']:
                 suffix = MODES_MAP[suffix]
@@ -174,7 +347,7 @@ class ClusteringFT():
             elif prefix == 'throttle':
                 value = int(float(suffix))
                 if value in [-100, 0, 225, 260]:
-                    suffix = random.choice([1, 2])
+                    suffix = rng.choice([1, 2])
                 elif value in [100, 435, 550]:
                     suffix = 3
                 elif value in [300, 445, 600]:
@@ -187,22 +360,134 @@ class ClusteringFT():
             if suffix not in fuzz_test_args[prefix]:
                 fuzz_test_args[prefix].append(suffix)
         
-        return fuzz_test_args
+        return canonical_fuzz_args(fuzz_test_args)
     
 
     def run_probes(self, index, ones_columns, fuzz_args):
         print('[ClusteringFT] Running Probe - ', fuzz_args)
+        # every probe starts from an empty journal and result store
+        remove_probe_files()
         self.fuzz_testor = ft.Fuzz_Testor()
         fuzz_test = ft.Fuzz_Test(**fuzz_args)
         self.fuzz_testor.run_test(fuzz_test)
         self.fuzz_testor.test_complete.wait()
-        os.system("rm executed_tests.pkl")
-        os.system("rm Fuzz_Test_Logs.txt") 
         self.fuzz_testor.test_complete.clear()
         self.fuzz_testor.trigger_shutdown()
+        # after the shutdown, which waits for the last results to be recorded
+        remove_probe_files()
         var = self.decision_tree(index, ones_columns, self.fuzz_testor.output)
+        if self.probe_cache is not None:
+            self.probe_cache.put(fuzz_args, self.fuzz_testor.output)
         return var
 
+    def fly_rows(self, comb, indexes):
+        '''Set the result of the given truth table rows, flying the probes not in the cache. Returns the flights made.'''
+        flights = 0
+        #probe key -> (fuzz args, rows waiting for it); rows with the same fuzz args share one flight
+        probes = {}
+        for index in indexes:
+            row = self.truthTable.loc[index]
+            print('[Debug] Running Truth table row - ')
+            print(row)
+
+            ones_columns = [col for col in self.truthTable.columns if row[col] == 1 and col != 'result']
+
+            fuzz_args = self.create_fuzz_args(ones_columns)
+
+            cached = self.probe_cache.get(fuzz_args) if self.probe_cache is not None else None
+            if cached is not None:
+                print('[ClusteringFT] Probe cache hit - ', fuzz_args)
+                # the oracle is re-run on the cached output (no flight) so the anomaly file still gets this row
+                self.truthTable.at[index, 'result'] = self.decision_tree(comb, ones_columns, cached)
+            elif self.probe_pool is None:
+                # Run probes and get the result
+                result_value = self.run_probes(comb, ones_columns, fuzz_args)
+                # result_value = random.choice([0, 1])
+                flights += 1
+
+                # Set the result value for the current row
+                self.truthTable.at[index, 'result'] = result_value
+            else:
+                probes.setdefault(probe_key(fuzz_args), (fuzz_args, []))[1].append((index, ones_columns))
+
+        if probes:
+            def on_result(key, output):
+                fuzz_args, rows = probes[key]
+                for index, ones_columns in rows:
+                    self.truthTable.at[index, 'result'] = self.decision_tree(comb, ones_columns, output)
+                if self.probe_cache is not None:
+                    self.probe_cache.put(fuzz_args, output)
+            self.probe_pool.run([(key, fuzz_args) for key, (fuzz_args, _) in probes.items()], on_result)
+            flights += len(probes)
+        return flights
+
+    def next_probes(self, count):
+        '''
+        Pick up to count unflown rows, the ones that tell the most about the logic function first.
+
+        The flown rows are minimized twice with the unflown and infeasible rows as don't-cares:
+        once covering the anomalies (predicts 1) and once covering the clean rows (predicts 0).
+        Rows both covers contain are contested and come first, then rows neither contains, and
+        last the rows the partial logic already implies (only one cover contains them). Ties go
+        to the row farthest from every flown row.
+        '''
+        features = [col for col in self.truthTable.columns if col != 'result']
+        rows = self.truthTable[features].to_numpy(dtype=np.int8)
+        results = self.truthTable['result'].to_numpy()
+        known = np.array([result is not None for result in results])
+        onset = rows[known & (results == 1)]
+        offset = rows[known & (results == 0)]
+        unknown = np.flatnonzero(~known)
+
+        anomalies = FaultTreeHelper.cover_contains(FaultTreeHelper.expand_cover(onset, offset), rows[unknown])
+        clean = FaultTreeHelper.cover_contains(FaultTreeHelper.expand_cover(offset, onset), rows[unknown])
+        score = np.where(anomalies & clean, 2, np.where(anomalies | clean, 0, 1))
+        if known.any():
+            distance = (rows[unknown][:, None, :] != rows[known][None, :, :]).sum(axis=2).min(axis=1)
+        else:
+            distance = np.zeros(len(unknown), dtype=int)
+
+        order = sorted(range(len(unknown)), key=lambda i: (-score[i], -distance[i], unknown[i]))
+        return [self.truthTable.index[unknown[i]] for i in order[:count]]
+
+    def run_adaptive(self, comb):
+        '''
+        Fly the truth table rows one batch at a time (one row per vehicle stack), most informative
+        first, until the minimized function has not changed for stable_probes flights or
+        flight_budget flights were made. Unflown rows are dropped from the truth table and
+        become don't-cares of the logic function.
+        '''
+        features = [col for col in self.truthTable.columns if col != 'result']
+        batch = len(self.probe_pool.stacks) if self.probe_pool is not None else 1
+        flights = 0
+        unchanged = 0
+        expression = None
+        while self.flight_budget is None or flights < self.flight_budget:
+            count = batch if self.flight_budget is None else min(batch, self.flight_budget - flights)
+            indexes = self.next_probes(count)
+            if not indexes:
+                break
+            made = self.fly_rows(comb, indexes)
+            flights += made
+
+            known = self.truthTable[self.truthTable['result'].notna()]
+            rows = known[features].to_numpy(dtype=np.int8)
+            results = known['result'].to_numpy()
+            cover = FaultTreeHelper.expand_cover(rows[results == 1], rows[results == 0])
+            latest = FaultTreeHelper.cover_expression(cover, features)
+            print('[ClusteringFT] Partial Logic Function - ', latest)
+            unchanged = unchanged + made if latest == expression else 0
+            expression = latest
+            if unchanged >= self.stable_probes:
+                print(f'[ClusteringFT] Logic function stable for {unchanged} flights')
+                break
+        else:
+            print(f'[ClusteringFT] Flight budget of {self.flight_budget} reached')
+
+        skipped = self.truthTable['result'].isna()
+        print(f'[ClusteringFT] {flights} flights, {int(skipped.sum())} rows not flown')
+        self.truthTable = self.truthTable[~skipped]
+
     def run_pipeline(self):
         self.top_features = clt.Clustering()
         print('[ClusteringFT] Top Combinations from Clustering - ', self.top_features)
@@ -215,32 +500,16 @@ class ClusteringFT():
             print('[Debug] Running Combination ' +str(comb))
             print('[Debug] Combination Details - ', features)
 
-            combinations = list(itertools.product([0, 1], repeat=len(features)))
-
-            # Create a dataframe from these combinations
-            self.truthTable = pd.DataFrame(combinations, columns=features)
+            # Create a dataframe from the feasible rows only; the other rows are don't-cares
+            self.truthTable = pd.DataFrame.from_records(feasible_rows(features), columns=features)
 
             # Add a 'result' column with NaN values
             self.truthTable['result'] = None
 
-            self.validate_combinations()
-
-            for index, row in self.truthTable.iterrows():
-                if row['result'] is None:
-                    print('[Debug] Running Truth table row - ')
-                    print(row)
-
-                    ones_columns = [col for col in self.truthTable.columns if row[col] == 1 and col != 'result']
-
-                    fuzz_args = self.create_fuzz_args(ones_columns)
-
-                    # Run probes and get the result
-                    result_value = self.run_probes(comb, ones_columns, fuzz_args)
-                    # result_value = random.choice([0, 1])
-
-                    # Set the result value for the current row
-                    self.truthTable.at[index, 'result'] = result_value
-
+            if self.adaptive:
+                self.run_adaptive(comb)
+            else:
+                self.fly_rows(comb, [index for index in self.truthTable.index if self.truthTable.at[index, 'result'] is None])
 
             self.fault_tree_helpers(comb)
             print('[ClusteringFT] Final Truth Table for the combination - ')
@@ -252,5 +521,23 @@ class ClusteringFT():
         return
 
 
-cl = ClusteringFT()
-cl.run_pipeline()
+if __name__ == '__main__':
+    # guarded: probe workers are spawned processes that import this module
+    parser = argparse.ArgumentParser(description="Clustering-guided fault tree construction.")
+    parser.add_argument('--stacks', default=None, help='JSON list of Vehicle_Stack fields to fly probes on in parallel.')
+    parser.add_argument('--probe-cache', default=PROBE_CACHE, help='Probe cache file.')
+    parser.add_argument('--no-probe-cache', action='store_true', help='Fly every probe, even ones flown before.')
+    parser.add_argument('--adaptive', action='store_true', help='Fly the most informative rows first and skip rows implied by the flown ones.')
+    parser.add_argument('--flight-budget', type=int, default=None, help='Most flights per truth table in adaptive mode.')
+    parser.add_argument('--stable-probes', type=int, default=STABLE_PROBES, help='Stop adaptive mode after this many flights without a change of the logic function.')
+    parser.add_argument('--truth-table', nargs='+', default=None, help='Saved truth table CSVs to build fault trees from again, without flying.')
+    args = parser.parse_args()
+
+    cl = ClusteringFT(load_stacks(args.stacks) if args.stacks else None, None if args.no_probe_cache else args.probe_cache,
+                      args.adaptive, args.flight_budget, args.stable_probes)
+    if args.truth_table:
+        for comb, path in enumerate(args.truth_table):
+            cl.truthTable = load_truth_table(path)
+            cl.fault_tree_helpers(comb)
+    else:
+        cl.run_pipeline()
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import sqlite3
+import time
+
+'''
+Persistent probe result cache.
+
+A probe is identified by its fuzz arguments (the output of ClusteringFT.create_fuzz_args)
+in canonical form: keys sorted and every list sorted, so rows of different truth tables
+that map to the same Fuzz_Test share one entry. The entry holds the fuzz testor output
+(JSON) of the probe; the oracle (decision_tree) is run again on it for every row, since
+its verdict also depends on the row. A repeated row or a re-run of the whole pipeline
+costs no flight.
+
+Delete the cache file (PROBE_CACHE) after changing the mission, the vehicle setup or the oracle.
+'''
+
+PROBE_CACHE = 'probe_cache.db'
+
+def canonical_fuzz_args(fuzz_args):
+    '''Fuzz arguments with every list sorted (values of one argument are a set to Fuzz_Test).'''
+    return {key: sorted(value, key=repr) if isinstance(value, list) else value for key, value in fuzz_args.items()}
+
+def probe_key(fuzz_args):
+    '''Content address of a probe: SHA-256 of its canonical fuzz arguments.'''
+    canonical = json.dumps(canonical_fuzz_args(fuzz_args), sort_keys=True)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class Probe_Cache():
+    '''
+    Args:
+        path (str): SQLite file holding the cache. Created if it does not exist.
+    '''
+
+    def __init__(self, path=PROBE_CACHE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS probes (key TEXT PRIMARY KEY, fuzz_args TEXT, output TEXT, recorded_at REAL)")
+
+    def get(self, fuzz_args):
+        '''Fuzz testor output of a probe flown before, or None.'''
+        row = self.connection.execute("SELECT output FROM probes WHERE key = ?", (probe_key(fuzz_args),)).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, fuzz_args, output):
+        values = (probe_key(fuzz_args), json.dumps(canonical_fuzz_args(fuzz_args), sort_keys=True), output, time.time())
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO probes (key, fuzz_args, output, recorded_at) VALUES (?, ?, ?, ?)", values)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM probes").fetchone()[0]
+
+    def close(self):
+        self.connection.close()